@@ -1,5 +1,6 @@
 from bpm.bpm_extractor import get_song_bpm
-from utilities.filehandler.audio_loader import get_mono_loaded_song
+from utilities.filehandler.audio_loader import get_mono_loaded_song, \
+    decode_song, get_decoded_song, get_mono_resampled_song
 
 
 def test_get_song_bpm():
@@ -9,3 +10,13 @@ def test_get_song_bpm():
 
     assert round(bpm, 3) == 139.847
     assert round(confidence, 4) == 2.4134
+
+
+def test_get_decoded_song_bpm(tmp_path):
+    path, sample_rate = decode_song(
+        "bpm/t/test_bpm_extractor/8376-1-" +
+        "1_Demolition_Man_proud_music_preview.wav", str(tmp_path))
+    song = get_mono_resampled_song(get_decoded_song(path), sample_rate)
+    bpm, confidence = get_song_bpm(song)
+
+    assert round(bpm, 3) == 139.847
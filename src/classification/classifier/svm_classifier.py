@@ -0,0 +1,69 @@
+import os
+from functools import lru_cache
+from typing import Tuple, List
+
+import yaml
+from essentia.standard import MusicExtractor
+
+from utilities.filehandler.handle_path import get_absolute_path
+
+
+# The classifiers read from the high level descriptors, in the order
+# they are returned in
+CLASSIFIERS = ['timbre', 'mood_relaxed', 'mood_party',
+               'mood_aggressive', 'mood_happy', 'mood_sad']
+
+
+def get_svm_models() -> List[str]:
+    """Gets the SVM models listed in the timbre and moods profile
+
+    Returns
+    -------
+    List[str]
+        The absolute paths of the model files
+    """
+
+    profile_file = get_absolute_path("utilities/ressources/" +
+                                     "timbre_moods_profile.yaml")
+
+    with open(profile_file, "r") as file:
+        profile = yaml.load(file, Loader=yaml.FullLoader)
+
+    # The model paths in the profile are relative to this directory
+    dirname = os.path.abspath(os.path.dirname(__file__))
+
+    return list(map(lambda model: os.path.normpath(
+        os.path.join(dirname, model)), profile['highlevel']['svm_models']))
+
+
+@lru_cache(maxsize=1)
+def _get_extractor():
+    # The models are loaded when the extractor is configured, so
+    # it is created once and reused for every song in the process
+    return MusicExtractor(highlevel=get_svm_models())
+
+
+def get_song_classifier_data(
+    song_path: str) -> Tuple[
+        Tuple, Tuple, Tuple, Tuple, Tuple, Tuple]:
+    """Extracts the highlevel mood classifications from a given song file
+    within the current process
+
+    Parameters
+    ----------
+    song_path
+        single song file path
+
+    Returns
+    -------
+    Tuple[Tuple, Tuple, Tuple, Tuple, Tuple, Tuple]
+        A tuple of tuples describing all moods and their probability
+    """
+
+    features, _ = _get_extractor()(get_absolute_path(song_path))
+
+    t = list(map(lambda name: (
+        features['highlevel.{}.value'.format(name)],
+        features['highlevel.{}.probability'.format(name)]), CLASSIFIERS))
+
+    return t[0], t[1], t[2], t[3], t[4], t[5]
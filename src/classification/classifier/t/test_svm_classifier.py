@@ -0,0 +1,28 @@
+import os
+
+from classification.classifier.svm_classifier import get_svm_models, \
+    get_song_classifier_data
+from utilities.filehandler.handle_path import get_absolute_path
+
+
+def test_get_svm_models():
+    models = get_svm_models()
+
+    assert len(models) == 6
+    assert all(map(os.path.isabs, models))
+    assert all(map(lambda model: model.endswith('.history'), models))
+    assert os.path.basename(models[4]) == 'mood_happy.history'
+
+
+def test_song_classifier_data():
+    song_data = get_song_classifier_data(
+        get_absolute_path("classification/t/test_segmented_audio_" +
+                          "analysis/8376-1-1_Demolition_Man_proud_" +
+                          "music_preview.wav"))
+
+    assert song_data[0][0] == "dark"
+    assert song_data[1][0] == "not_relaxed"
+    assert song_data[2][0] == "not_party"
+    assert song_data[3][0] == "aggressive"
+    assert song_data[4][0] == "not_happy"
+    assert song_data[5][0] == "not_sad"
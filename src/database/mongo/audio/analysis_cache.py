@@ -0,0 +1,86 @@
+import datetime
+
+from database.mongo.database import Database
+from database.mongo.storinator import Storinator
+
+
+class AnalysisCache(Storinator):
+    """
+    An extension to the database class that stores analysis results by the
+    fingerprint of the analyzed audio, so audio that exists under several
+    paths or ids only has to be analyzed once
+
+    Methods
+    -------
+    add(content_hash, data)
+        Insert or replace the results for the given audio fingerprint
+
+    get(content_hash)
+        Gets the results for the given audio fingerprint
+
+    get_all()
+        Gets all documents from the analysis_cache collection
+
+    close()
+        Closes the connection to the database
+    """
+
+    def __init__(self):
+        self._col = 'analysis_cache'
+        self._db = Database()
+
+    def add(self, content_hash: str, data: dict) -> str:
+        """Insert or replace the results for the given audio fingerprint
+
+        Parameters
+        ----------
+        content_hash : str
+            The fingerprint of the audio
+        data : dict
+            The analysis results of the audio
+
+        Returns
+        -------
+        str
+            The created document's object id, None if it already existed
+        """
+
+        doc = {**data, "content_hash": content_hash,
+               "last_updated": datetime.datetime.utcnow()}
+
+        return self._db._db[self._col].update_one(
+            {'content_hash': content_hash}, {'$set': doc},
+            upsert=True).upserted_id
+
+    def get(self, content_hash: str) -> object:
+        """Gets the results for the given audio fingerprint
+
+        Parameters
+        ----------
+        content_hash : str
+            The fingerprint of the audio
+
+        Returns
+        -------
+        object
+            Either a None object or the object from the database
+        """
+
+        return self._db._db[self._col].find_one(
+            {'content_hash': content_hash})
+
+    def get_all(self) -> [object]:
+        """Gets all documents from the analysis_cache collection
+
+        Returns
+        -------
+        object list
+            A list of the objects in the analysis_cache collection
+        """
+
+        return self._db.find_all(self._col)
+
+    def close(self):
+        """Closes the connection to the database"""
+
+        self._db.close()
@@ -0,0 +1,152 @@
+import datetime
+
+from pymongo import ASCENDING, ReplaceOne
+
+from database.mongo.database import Database
+from database.mongo.storinator import Storinator
+
+
+class SimilarSegments(Storinator):
+    """
+    An extension to the database class that stores the similar segments of
+    every song segment in a read-ready form, with the song and time range
+    of each similar segment embedded, so they can be served without
+    looking anything else up
+
+    Methods
+    -------
+    add(segment_id, song_id, time_from, time_to, similar)
+        Insert or replace the similar segments of a song segment
+
+    add_many(results)
+        Insert or replace the similar segments of many song segments
+
+    get(song_id)
+        Gets the similar segments of every segment of a song
+
+    get_overlapping(song_id, from_time, to_time)
+        Gets the similar segments of the segments of a song
+        overlapping the given time range
+
+    get_all()
+        Gets all documents from the similarity_results collection
+
+    close()
+        Closes the connection to the database
+    """
+
+    # Whether the indexes have been created by this process
+    _indexed = False
+
+    def __init__(self):
+        self._col = 'similarity_results'
+        self._db = Database()
+
+        if not SimilarSegments._indexed:
+            self._db._db[self._col].create_index(
+                [('song_id', ASCENDING), ('time_from', ASCENDING)])
+            SimilarSegments._indexed = True
+
+    def add(self, segment_id, song_id: str, time_from: int, time_to: int,
+            similar: [dict]):
+        """Insert or replace the similar segments of a song segment
+
+        Parameters
+        ----------
+        segment_id
+            The object id of the segment in the song_segmentation collection
+        song_id : str
+            The id of the song
+        time_from : int
+            The start of the segment
+        time_to : int
+            The end of the segment
+        similar : [dict]
+            The similar segments, each with a song_id, from_time,
+            to_time and distance
+        """
+
+        self.add_many([(segment_id, song_id, time_from, time_to, similar)])
+
+    def add_many(self, results: list):
+        """Insert or replace the similar segments of many song segments
+
+        Parameters
+        ----------
+        results : list of Tuple[segment_id, song_id: str, time_from: int,
+                                time_to: int, similar: [dict]]
+            The segments and their similar segments
+        """
+
+        if len(results) == 0:
+            return
+
+        now = datetime.datetime.utcnow()
+
+        self._db._db[self._col].bulk_write(list(map(
+            lambda result: ReplaceOne({'_id': result[0]}, {
+                'song_id': result[1],
+                'time_from': result[2],
+                'time_to': result[3],
+                'similar': result[4],
+                'last_updated': now,
+            }, upsert=True), results)), ordered=False)
+
+    def get(self, song_id: str) -> [object]:
+        """Gets the similar segments of every segment of a song
+
+        Parameters
+        ----------
+        song_id : str
+            The id of the song
+
+        Returns
+        -------
+        object list
+            The segments of the song, ordered by time
+        """
+
+        return list(self._db._db[self._col].find(
+            {'song_id': song_id}).sort('time_from', ASCENDING))
+
+    def get_overlapping(self, song_id: str, from_time: int,
+                        to_time: int) -> [object]:
+        """Gets the similar segments of the segments of a song
+        overlapping the given time range
+
+        Parameters
+        ----------
+        song_id : str
+            The id of the song
+        from_time : int
+            The start of the time range
+        to_time : int
+            The end of the time range
+
+        Returns
+        -------
+        object list
+            The overlapping segments of the song, ordered by time
+        """
+
+        return list(self._db._db[self._col].find({
+            'song_id': song_id,
+            'time_from': {'$lt': to_time},
+            'time_to': {'$gt': from_time},
+        }).sort('time_from', ASCENDING))
+
+    def get_all(self) -> [object]:
+        """Gets all documents from the similarity_results collection
+
+        Returns
+        -------
+        object list
+            A list of the objects in the similarity_results collection
+        """
+
+        return self._db.find_all(self._col)
+
+    def close(self):
+        """Closes the connection to the database"""
+
+        self._db.close()
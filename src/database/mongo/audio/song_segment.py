@@ -1,7 +1,63 @@
-from database.mongo.database import Database
+import numpy as np
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+
+from database.mongo.database import Database, _create_default_document, \
+    _augment_document
 from database.mongo.storinator import Storinator
 
 
+# The per-feature fields segments were stored with before the
+# combined feature vector, kept only until they have been migrated
+LEGACY_FEATURE_FIELDS = ['mfcc', 'chroma', 'tempogram']
+
+
+def encode_array(array) -> dict:
+    """Encodes a numpy array with the dtype and shape
+    needed to decode it again
+
+    Parameters
+    ----------
+    array
+        The numpy array to encode
+
+    Returns
+    -------
+    dict
+        The raw bytes of the array together with its dtype and shape
+    """
+
+    return {
+        "data": array.tobytes(),
+        "dtype": array.dtype.str,
+        "shape": list(array.shape),
+    }
+
+
+def decode_array(doc: dict):
+    """Decodes a numpy array encoded by encode_array
+
+    Parameters
+    ----------
+    doc : dict
+        The encoded array
+
+    Returns
+    -------
+    ndarray
+        The decoded array
+    """
+
+    return np.frombuffer(doc['data'], dtype=doc['dtype']).reshape(doc['shape'])
+
+
+def _projection(fields: [str]) -> dict:
+    # Only the given fields are fetched, or every field if none are given
+    if fields is None:
+        return None
+
+    return dict(map(lambda field: (field, True), fields))
+
+
 class SongSegment(Storinator):
     """
     An extension to the database class that calls its methods with other
@@ -16,13 +72,23 @@ class SongSegment(Storinator):
         Gets the newest document with the given song id in the
         song_segmentation collection
 
-    get_by_ids(ids)
+    get_by_ids(ids, fields)
         Gets all song segments from the song_segmentation
         collection by document object ids
 
+    get_covering(song_id, time, fields)
+        Gets the song segment covering the given time of a song
+
+    get_overlapping(song_id, from_time, to_time, fields)
+        Gets the song segments overlapping the given time range of a song
+
     get_all_by_song_id(song_id)
         Gets all song segments from the song_segmentation collection by song id
 
+    get_segmented_song_ids(song_ids)
+        Finds which of the given songs have segments in the
+        song_segmentation collection
+
     get_all()
         Gets all song_segments from the database
 
@@ -30,9 +96,23 @@ class SongSegment(Storinator):
         Get all documents in the song_segmentation collection
         in the given time range
 
+    get_batches(batch_size, fields)
+        Streams all documents in the song_segmentation collection in batches
+
+    get_sample(size, fields)
+        Gets a random sample of the documents in the
+        song_segmentation collection
+
     update_similar(id, similar)
         Updates a document in the song_segmentation collection
 
+    update_similar_many(similar, batch_size)
+        Updates the similar segments of many documents in the
+        song_segmentation collection
+
+    update_features(features)
+        Replaces the features of documents in the song_segmentation collection
+
     count()
         Counts the number of documents in the song_segmentation collection
 
@@ -40,12 +120,22 @@ class SongSegment(Storinator):
         Closes the connection to the database
     """
 
+    # Whether the indexes have been created by this process
+    _indexed = False
+
     def __init__(self):
         self._dbcol = 'song_segmentation'
         self._db = Database()
 
+        if not SongSegment._indexed:
+            # Segments are looked up by song and start time, this is
+            # also the key add upserts on
+            self._db._db[self._dbcol].create_index(
+                [('song_id', ASCENDING), ('time_from', ASCENDING)])
+            SongSegment._indexed = True
+
     def add(self, song_id: str, time_from: int, time_to: int,
-            mfcc, chroma, tempogram, similar) -> str:
+            feature, similar) -> str:
         """Insert song segment into the song_segmentation collection
 
         Parameters
@@ -56,13 +146,10 @@ class SongSegment(Storinator):
             The start of the time interval
         time_to : int
             The end of the time interval
-        mfcc
-
-        chroma
-
-        tempogram
-
+        feature
+            The combined feature vector of the segment as a numpy array
         similar
+            Array of similar song segments
 
         Returns
         -------
@@ -70,15 +157,22 @@ class SongSegment(Storinator):
             The document's object id
         """
 
-        return self._db.insert(self._dbcol, song_id, {
+        # A song has many segments, so they are keyed by their start time
+        # as well, and the id is returned whether the segment is new or not
+        doc = _augment_document(_create_default_document(song_id), {
             "time_from": time_from,
             "time_to": time_to,
-            "mfcc": mfcc,
-            "chroma": chroma,
-            "tempogram": tempogram,
+            "feature": None if feature is None else encode_array(feature),
             "similar": similar,
         })
 
+        return self._db._db[self._dbcol].find_one_and_update(
+            {'song_id': song_id, 'time_from': time_from},
+            {'$set': doc,
+             '$unset': dict(map(lambda f: (f, True), LEGACY_FEATURE_FIELDS))},
+            projection={'_id': True}, upsert=True,
+            return_document=ReturnDocument.AFTER)['_id']
+
     def get(self, song_id: str):
         """Gets the newest document with the given song id
         in the song_segmentation collection
@@ -96,7 +190,7 @@ class SongSegment(Storinator):
 
         return self._db.find(self._dbcol, song_id)
 
-    def get_by_ids(self, ids: [str]):
+    def get_by_ids(self, ids: [str], fields: [str] = None):
         """Gets all song segments from the song_segmentation
         collection by document object ids
 
@@ -104,6 +198,8 @@ class SongSegment(Storinator):
         ----------
         ids : [str]
             List of document object ids
+        fields : [str], optional
+            The fields to fetch, given none every field is fetched
 
         Returns
         -------
@@ -112,11 +208,89 @@ class SongSegment(Storinator):
         """
 
         results = []
-        for r in self._db._db[self._dbcol].find({'_id': {'$in': ids}}):
+        for r in self._db._db[self._dbcol].find(
+                {'_id': {'$in': ids}}, _projection(fields)):
             results.append(r)
 
         return results
 
+    def get_covering(self, song_id: str, time: int, fields: [str] = None):
+        """Gets the song segment covering the given time of a song,
+        or the segment starting closest to it if none covers it
+
+        Parameters
+        ----------
+        song_id : str
+            The id of the song
+        time : int
+            The time in the song
+        fields : [str], optional
+            The fields to fetch, given none every field is fetched
+
+        Returns
+        -------
+        object
+            Either a None object or the object from the database
+        """
+
+        projection = _projection(fields)
+        if projection is not None:
+            projection['time_from'] = True
+            projection['time_to'] = True
+
+        collection = self._db._db[self._dbcol]
+
+        # Both are a single step through the (song_id, time_from) index
+        before = collection.find_one(
+            {'song_id': song_id, 'time_from': {'$lte': time}}, projection,
+            sort=[('time_from', DESCENDING)])
+
+        if before is not None and time < before.get('time_to', time):
+            return before
+
+        after = collection.find_one(
+            {'song_id': song_id, 'time_from': {'$gt': time}}, projection,
+            sort=[('time_from', ASCENDING)])
+
+        if before is None or (after is not None and
+                              after['time_from'] - time <
+                              time - before['time_from']):
+            return after
+
+        return before
+
+    def get_overlapping(self, song_id: str, from_time: int, to_time: int,
+                        fields: [str] = None) -> [object]:
+        """Gets the song segments overlapping the given time range of a song
+
+        Parameters
+        ----------
+        song_id : str
+            The id of the song
+        from_time : int
+            The start of the time range
+        to_time : int
+            The end of the time range
+        fields : [str], optional
+            The fields to fetch, given none every field is fetched
+
+        Returns
+        -------
+        object list
+            The overlapping segments, ordered by time
+        """
+
+        projection = _projection(fields)
+        if projection is not None:
+            projection['time_from'] = True
+            projection['time_to'] = True
+
+        return list(self._db._db[self._dbcol].find({
+            'song_id': song_id,
+            'time_from': {'$lt': to_time},
+            'time_to': {'$gt': from_time},
+        }, projection).sort('time_from', ASCENDING))
+
     def get_all_by_song_id(self, song_id: str):
         """Gets all song segments from the song_segmentation collection by song id
 
@@ -133,6 +307,24 @@ class SongSegment(Storinator):
 
         return self._db.find_all_by_id(self._dbcol, song_id)
 
+    def get_segmented_song_ids(self, song_ids: [str]) -> set:
+        """Finds which of the given songs have segments in the
+        song_segmentation collection, using a single query
+
+        Parameters
+        ----------
+        song_ids : [str]
+            The ids of the songs
+
+        Returns
+        -------
+        set
+            The ids of the songs that have segments
+        """
+
+        return set(self._db._db[self._dbcol].distinct(
+            'song_id', {'song_id': {'$in': list(song_ids)}}))
+
     def get_all(self):
         """Gets all song_segments from the database
 
@@ -171,6 +363,71 @@ class SongSegment(Storinator):
 
         return results
 
+    def get_batches(self, batch_size: int, fields: [str] = None,
+                    query: dict = None):
+        """Streams all documents in the song_segmentation collection in
+        batches, paginating by document object id so that every batch is
+        a single indexed range query
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of documents in each batch
+        fields : [str], optional
+            The fields to fetch, given none every field is fetched
+        query : dict, optional
+            A filter for the documents to fetch
+
+        Yields
+        ------
+        object list
+            The next batch of objects from the collection, ordered by id
+        """
+
+        projection = _projection(fields)
+
+        query = query or {}
+        page = query
+        while True:
+            batch = list(self._db._db[self._dbcol].find(
+                page, projection).sort('_id', 1).limit(batch_size))
+
+            if len(batch) == 0:
+                return
+
+            yield batch
+
+            page = {'$and': [query, {'_id': {'$gt': batch[-1]['_id']}}]}
+
+    def get_sample(self, size: int, fields: [str] = None,
+                   query: dict = None):
+        """Gets a random sample of the documents in the
+        song_segmentation collection
+
+        Parameters
+        ----------
+        size : int
+            The number of documents in the sample
+        fields : [str], optional
+            The fields to fetch, given none every field is fetched
+        query : dict, optional
+            A filter for the documents to sample from
+
+        Returns
+        -------
+        object list
+            The sampled objects from the collection
+        """
+
+        pipeline = [{'$match': query or {}}, {'$sample': {'size': size}}]
+
+        projection = _projection(fields)
+        if projection is not None:
+            pipeline.append({'$project': projection})
+
+        return list(self._db._db[self._dbcol].aggregate(
+            pipeline, allowDiskUse=True))
+
     def update_similar(self, id: str, similar: []):
         """Updates a document in the song_segmentation collection
 
@@ -188,6 +445,45 @@ class SongSegment(Storinator):
             }
         })
 
+    def update_similar_many(self, similar: list, batch_size: int):
+        """Updates the similar segments of many documents in the
+        song_segmentation collection, with one unordered bulk write
+        for every batch of documents
+
+        Parameters
+        ----------
+        similar : list of Tuple[id: str, similar: []]
+            The ids of the documents and their similar song segments
+        batch_size : int
+            The number of documents updated by each bulk write
+        """
+
+        for start in range(0, len(similar), batch_size):
+            self._db._db[self._dbcol].bulk_write(list(map(
+                lambda s: UpdateOne({'_id': s[0]}, {
+                    '$set': {"similar": s[1]}
+                }), similar[start:start + batch_size])), ordered=False)
+
+    def update_features(self, features: list):
+        """Replaces the features of documents in the song_segmentation
+        collection, removing any features stored in the legacy format
+
+        Parameters
+        ----------
+        features : list of Tuple[id: str, feature]
+            The ids of the documents and their new feature vectors
+        """
+
+        if len(features) == 0:
+            return
+
+        self._db._db[self._dbcol].bulk_write(list(map(
+            lambda f: UpdateOne({'_id': f[0]}, {
+                '$set': {"feature": encode_array(f[1])},
+                '$unset': dict(map(lambda l: (l, True),
+                                   LEGACY_FEATURE_FIELDS)),
+            }), features)), ordered=False)
+
     def count(self) -> int:
         """Counts the number of documents in the song_segmentation collection
 
@@ -0,0 +1,70 @@
+import os
+import threading
+
+from pymongo import MongoClient
+
+from utilities.config_loader import load_config
+
+
+_clients = {}
+_clients_pid = None
+_lock = threading.Lock()
+
+
+def get_client(auth_source: str = None) -> MongoClient:
+    """Gets the MongoDB client shared by everything in this process
+
+    A client holds a pool of connections and is safe to use from several
+    threads, so creating one per query only costs a new connection and
+    authentication. Clients are not safe to use across a fork, so a forked
+    process, like a Celery or multiprocessing worker, gets clients of its
+    own the first time it asks for one.
+
+    Parameters
+    ----------
+    auth_source : str, optional
+        The database to authenticate against
+
+    Returns
+    -------
+    MongoClient
+        The client for the configured server
+    """
+
+    global _clients, _clients_pid
+
+    with _lock:
+        if _clients_pid != os.getpid():
+            # The clients of the parent process are left alone, closing
+            # them here would close the parent's connections
+            _clients = {}
+            _clients_pid = os.getpid()
+
+        if auth_source not in _clients:
+            cfg = load_config()
+
+            options = {}
+            if auth_source is not None:
+                options['authSource'] = auth_source
+
+            # Connecting is left until the first query, so a client created
+            # before a fork never has connections for the child to inherit
+            _clients[auth_source] = MongoClient(
+                cfg['mongo_host'], cfg['mongo_port'],
+                username=cfg['mongo_user'], password=cfg['mongo_pass'],
+                maxPoolSize=cfg['mongo_max_pool_size'], connect=False,
+                **options)
+
+        return _clients[auth_source]
+
+
+def close_clients():
+    """Closes the clients of this process, for use when shutting down"""
+
+    global _clients
+
+    with _lock:
+        if _clients_pid == os.getpid():
+            for client in _clients.values():
+                client.close()
+        _clients = {}
@@ -1,9 +1,8 @@
 import datetime
 from typing import Dict
 
-from pymongo import MongoClient
-
 from utilities.config_loader import load_config
+from database.mongo.client import get_client
 
 
 def _create_default_document(id: str) -> Dict:
@@ -90,10 +89,7 @@ class Database:
     def __init__(self):
         cfg = load_config()
 
-        self._client = MongoClient(
-            cfg['mongo_host'], cfg['mongo_port'],
-            username=cfg['mongo_user'], password=cfg['mongo_pass'],
-            authSource=cfg['mongo_db'])
+        self._client = get_client(cfg['mongo_db'])
         self._db = self._client[cfg['mongo_db']]
 
     def insert(self, col: str, song_id: str, doc: dict) -> str:
@@ -189,6 +185,8 @@ class Database:
         return results
 
     def close(self):
-        """Closes the connection to the database"""
+        """Closes the connection to the database
 
-        self._client.close()
+        The client is shared by the whole process and stays open, its
+        connections are returned to the pool as soon as a query is done
+        """
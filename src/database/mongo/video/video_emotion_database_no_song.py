@@ -1,9 +1,8 @@
 import datetime
 from typing import Dict
 
-from pymongo import MongoClient
-
 from utilities.config_loader import load_config
+from database.mongo.client import get_client
 
 
 def _create_default_document(video_id: str) -> Dict:
@@ -74,9 +73,7 @@ class VEDatabase:
     def __init__(self):
         cfg = load_config()
 
-        self._client = MongoClient(
-            cfg['mongo_host'], cfg['mongo_port'],
-            username=cfg['mongo_user'], password=cfg['mongo_pass'])
+        self._client = get_client()
         self._db = self._client[cfg['mongo_db']]
 
     def insert(self, col: str, video_id: str,
@@ -173,6 +170,8 @@ class VEDatabase:
         return results
 
     def close(self):
-        """Closes the connection to the database"""
+        """Closes the connection to the database
 
-        self._client.close()
+        The client is shared by the whole process and stays open, its
+        connections are returned to the pool as soon as a query is done
+        """
@@ -1,18 +1,96 @@
 from typing import Dict
 import json
 
-from records import Database
-
 from utilities.config_loader import load_config
+from database.sql.engine import get_database
 
 
-class AudioDB:
-    def __init__(self):
-        cfg = load_config()
+MOODS = ['relaxed', 'party', 'aggressive', 'happy', 'sad']
+LOUDNESS_COLUMNS = ['peak', 'loudness_integrated', 'loudness_range']
+KEY_COLUMNS = ['audio_release', 'audio_side', 'audio_track']
+
+# The columns of each group of analysis data, as named by the API
+FIELD_GROUPS = {
+    'rhythm': ['bpm', 'bpm_confidence'],
+    'timbre': ['timbre', 'timbre_confidence'],
+    'emotions': [column for mood in MOODS
+                 for column in (mood, mood + '_confidence')],
+    'levels': LOUDNESS_COLUMNS,
+}
+
+# The clause turning an insert into an update of the given columns when the
+# song already exists, for the databases that have one
+_UPSERT_CLAUSES = {
+    'postgresql': ("ON CONFLICT ({}) DO UPDATE SET {}",
+                   "{0}=EXCLUDED.{0}"),
+    'sqlite': ("ON CONFLICT ({}) DO UPDATE SET {}",
+               "{0}=excluded.{0}"),
+    'mysql': ("ON DUPLICATE KEY UPDATE {1}",
+              "{0}=VALUES({0})"),
+}
+
+
+def _columns(data: Dict) -> Dict:
+    # The values of the columns for the groups of data a song has
+    columns = dict()
+
+    if 'BPM' in data:
+        columns['bpm'] = data['BPM']['value']
+        columns['bpm_confidence'] = data['BPM']['confidence']
+
+    if 'timbre' in data:
+        columns['timbre'] = data['timbre']['value']
+        columns['timbre_confidence'] = data['timbre']['confidence']
+
+    if 'emotions' in data:
+        for mood in MOODS:
+            columns[mood] = data['emotions'][mood]['value']
+            columns[mood + '_confidence'] = (
+                data['emotions'][mood]['confidence'])
+
+    if 'loudness' in data:
+        for column in LOUDNESS_COLUMNS:
+            columns[column] = data['loudness'][column]
+
+    return columns
 
-        self._db = Database("{}://{}:{}@{}/{}".format(
-            cfg['sql_type'], cfg['sql_user'], cfg['sql_pass'],
-            cfg['sql_host'], cfg['sql_db']))
+
+def _dialect() -> str:
+    # The name of the database, without the driver
+    return load_config()['sql_type'].split('+')[0]
+
+
+def _insert_query(columns: tuple) -> str:
+    return "INSERT INTO Audio ({}) VALUES (:rel, :side, :track{})".format(
+        ", ".join(KEY_COLUMNS + list(columns)),
+        "".join(map(lambda column: ", :" + column, columns)))
+
+
+def _update_query(columns: tuple) -> str:
+    return """UPDATE Audio SET {}
+        WHERE audio_release=:rel
+            AND audio_side=:side
+            AND audio_track=:track""".format(", ".join(
+        list(map(lambda column: "{0}=:{0}".format(column), columns)) +
+        ["last_updated=CURRENT_TIMESTAMP"]))
+
+
+def _upsert_query(dialect: str, columns: tuple) -> str:
+    # Inserts a song, or updates the given columns if it already exists
+    clause, assignment = _UPSERT_CLAUSES[dialect]
+
+    return "{} {}".format(_insert_query(columns), clause.format(
+        ", ".join(KEY_COLUMNS), ", ".join(
+            list(map(assignment.format, columns)) +
+            ["last_updated=CURRENT_TIMESTAMP"])))
+
+
+class AudioDB:
+    @property
+    def _db(self):
+        # Looked up on every use rather than kept, so an instance created
+        # before a fork uses the connection pool of the current process
+        return get_database()
 
     def _get_data(self, query, audio_id: str):
         ids = audio_id.split("-")
@@ -20,7 +98,10 @@ class AudioDB:
         if len(ids) != 3:
             return None
 
-        rows = self._db.query(query, rel=ids[0], side=ids[1], track=ids[2])
+        # Fetched at once, so the connection goes back to the pool before
+        # the rows are read
+        rows = self._db.query(query, fetchall=True,
+                              rel=ids[0], side=ids[1], track=ids[2])
 
         result = json.loads(rows.export("json"))
 
@@ -29,6 +110,54 @@ class AudioDB:
 
         return result[0]
 
+    def _get_many(self, columns: str, audio_ids: [str]) -> Dict:
+        # Ids that are written differently, such as 01-2-3 and 1-2-3,
+        # are the same song
+        keys = dict()
+        for audio_id in audio_ids:
+            ids = audio_id.split("-")
+
+            if len(ids) != 3:
+                continue
+
+            try:
+                key = tuple(map(int, ids))
+            except ValueError:
+                continue
+
+            keys.setdefault(key, []).append(audio_id)
+
+        results = dict()
+        keys_list = list(keys.keys())
+
+        # Bounds the number of parameters bound in a single query
+        for start in range(0, len(keys_list), 1000):
+            chunk = keys_list[start:start + 1000]
+
+            params = dict()
+            for i, (rel, side, track) in enumerate(chunk):
+                params['rel' + str(i)] = rel
+                params['side' + str(i)] = side
+                params['track' + str(i)] = track
+
+            query = """
+                SELECT audio_release, audio_side, audio_track, {}
+                FROM Audio
+                WHERE (audio_release, audio_side, audio_track) IN ({})
+                """.format(columns, ", ".join(map(
+                    lambda i: "(:rel{0}, :side{0}, :track{0})".format(i),
+                    range(len(chunk)))))
+
+            rows = self._db.query(query, fetchall=True, **params)
+
+            for row in json.loads(rows.export("json")):
+                key = (row['audio_release'], row['audio_side'],
+                       row['audio_track'])
+                for audio_id in keys[key]:
+                    results[audio_id] = row
+
+        return results
+
     def setup(self):
         self._db.query("""
         CREATE TABLE Audio
@@ -84,136 +213,139 @@ class AudioDB:
 
         return self._get_data(query, audio_id) is not None
 
-    def post_all(self, data: Dict) -> str:
-        if 'audio_id' not in data:
-            pass
+    def get_completed(self, audio_ids: [str]) -> set:
+        """Finds which of the given audio ids have been fully analyzed,
+        using a single query for all of them
 
-        ids = data['audio_id'].split("-")
+        Parameters
+        ----------
+        audio_ids : [str]
+            The ids of the audio to search for
 
-        if len(ids) != 3:
-            return None
+        Returns
+        -------
+        set
+            The ids that have BPM, emotion and loudness data
+        """
 
-        query = """
-        INSERT INTO Audio (
-            audio_release, audio_side, audio_track,
-            bpm, bpm_confidence, timbre,
-            timbre_confidence, relaxed,
-            relaxed_confidence, party,
-            party_confidence, aggressive,
-            aggressive_confidence, happy,
-            happy_confidence, sad,
-            sad_confidence, peak,
-            loudness_integrated, loudness_range
-        )
-        VALUES ("""
-
-        query = "{}{}, {}, {}, ".format(query, ids[0], ids[1], ids[2])
-
-        if 'BPM' in data:
-            query = "{}{}, {}, ".format(
-                query, data['BPM']['value'], data['BPM']['confidence'])
-        else:
-            query = query + "NULL, NULL, "
-
-        if 'timbre' in data:
-            query = "{}'{}', {}, ".format(
-                query, data['timbre']['value'], data['timbre']['confidence'])
-        else:
-            query = query + "NULL, NULL, "
-
-        if 'emotions' in data:
-            query = "{}'{}', {}, ".format(
-                query, data['emotions']['relaxed']['value'],
-                data['emotions']['relaxed']['confidence'])
-            query = "{}'{}', {}, ".format(
-                query, data['emotions']['party']['value'],
-                data['emotions']['party']['confidence'])
-            query = "{}'{}', {}, ".format(
-                query, data['emotions']['aggressive']['value'],
-                data['emotions']['aggressive']['confidence'])
-            query = "{}'{}', {}, ".format(
-                query, data['emotions']['happy']['value'],
-                data['emotions']['happy']['confidence'])
-            query = "{}'{}', {}, ".format(
-                query, data['emotions']['sad']['value'],
-                data['emotions']['sad']['confidence'])
-        else:
-            query = (query + "NULL, NULL, NULL, NULL, " +
-                     " NULL, NULL, NULL, NULL, NULL, NULL, ")
-
-        if 'loudness' in data:
-            query = "{}{}, ".format(query, data['loudness']['peak'])
-            query = "{}{}, ".format(
-                query, data['loudness']['loudness_integrated'])
-            query = "{}{})".format(query, data['loudness']['loudness_range'])
-        else:
-            query = query + "NULL, NULL, NULL)"
-
-        self._db.query(query)
+        rows = self._get_many("bpm, timbre, peak", audio_ids)
 
-    def update_all(self, data: Dict) -> str:
-        if 'audio_id' not in data:
-            pass
+        return set(map(lambda item: item[0], filter(
+            lambda item: (item[1]['bpm'] is not None and
+                          item[1]['timbre'] is not None and
+                          item[1]['peak'] is not None),
+            rows.items())))
 
-        ids = data['audio_id'].split("-")
+    def upsert(self, rows: [Dict]) -> int:
+        """Inserts or updates the analysis data of songs, only writing the
+        columns of the groups of data (BPM, timbre, emotions and loudness)
+        that each song has. Songs with the same groups are written with a
+        single prepared statement.
 
-        if len(ids) != 3:
-            return None
+        Parameters
+        ----------
+        rows : [Dict]
+            The data of the songs, each with an audio_id
+
+        Returns
+        -------
+        int
+            The number of songs written
+        """
+
+        statements = dict()
+        for data in rows:
+            ids = data.get('audio_id', '').split("-")
+
+            if len(ids) != 3:
+                continue
+
+            params = _columns(data)
+            columns = tuple(sorted(params.keys()))
+
+            params['rel'], params['side'], params['track'] = ids
+            statements.setdefault(columns, []).append(params)
+
+        dialect = _dialect()
+        for columns, params in statements.items():
+            if dialect in _UPSERT_CLAUSES:
+                self._db.bulk_query(_upsert_query(dialect, columns), *params)
+            else:
+                self._upsert_separately(columns, params)
+
+        return sum(map(len, statements.values()))
+
+    def _upsert_separately(self, columns: tuple, params: [Dict]):
+        # For databases without an upsert statement, the songs that
+        # already exist are updated and the rest inserted
+        existing = self._get_many("last_updated", map(
+            lambda row: "{}-{}-{}".format(
+                row['rel'], row['side'], row['track']), params))
+
+        updates = list(filter(lambda row: "{}-{}-{}".format(
+            row['rel'], row['side'], row['track']) in existing, params))
+        inserts = list(filter(lambda row: "{}-{}-{}".format(
+            row['rel'], row['side'], row['track']) not in existing, params))
+
+        if len(updates) > 0:
+            self._db.bulk_query(_update_query(columns), *updates)
+        if len(inserts) > 0:
+            self._db.bulk_query(_insert_query(columns), *inserts)
+
+    def get_many(self, audio_ids: [str], groups: [str] = None) -> Dict:
+        """Get the given groups of fields for many audio ids,
+        using a single query for every thousand of them
+
+        Parameters
+        ----------
+        audio_ids : [str]
+            The ids of the audio to search for
+        groups : [str], optional
+            The groups of fields to get, from FIELD_GROUPS,
+            given none every group is included
+
+        Returns
+        -------
+        Dict
+            The results by audio id, ids that were not found are left out
+        """
+
+        if groups is None:
+            groups = FIELD_GROUPS.keys()
+
+        unknown = set(groups) - set(FIELD_GROUPS.keys())
+        if len(unknown) > 0:
+            raise ValueError("Unknown field groups: {}".format(
+                ", ".join(sorted(unknown))))
+
+        columns = [column for group in FIELD_GROUPS if group in groups
+                   for column in FIELD_GROUPS[group]]
+
+        return self._get_many(", ".join(columns + ['last_updated']),
+                              audio_ids)
+
+    def post_all(self, data: Dict) -> str:
+        """Inserts the analysis data of a song
+
+        Parameters
+        ----------
+        data : Dict
+            The data of the song, with an audio_id
+        """
+
+        self.upsert([data])
+
+    def update_all(self, data: Dict) -> str:
+        """Updates the analysis data of a song, leaving the columns of
+        groups of data the song does not have untouched
+
+        Parameters
+        ----------
+        data : Dict
+            The data of the song, with an audio_id
+        """
 
-        query = "UPDATE Audio SET "
-
-        if 'BPM' in data:
-            query = "{}bpm={}, bpm_confidence={}, ".format(
-                query, data['BPM']['value'], data['BPM']['confidence'])
-        else:
-            query = query + "bpm=NULL, bpm_confidence=NULL, "
-
-        if 'timbre' in data:
-            query = "{}timbre='{}', timbre_confidence={}, ".format(
-                query, data['timbre']['value'], data['timbre']['confidence'])
-        else:
-            query = query + "timbre=NULL, timbre_confidence=NULL, "
-
-        if 'emotions' in data:
-            query = "{}relaxed='{}', relaxed_confidence={}, ".format(
-                query, data['emotions']['relaxed']['value'],
-                data['emotions']['relaxed']['confidence'])
-            query = "{}party='{}', party_confidence={}, ".format(
-                query, data['emotions']['party']['value'],
-                data['emotions']['party']['confidence'])
-            query = "{}aggressive='{}', aggressive_confidence={}, ".format(
-                query, data['emotions']['aggressive']['value'],
-                data['emotions']['aggressive']['confidence'])
-            query = "{}happy='{}', happy_confidence={}, ".format(
-                query, data['emotions']['happy']['value'],
-                data['emotions']['happy']['confidence'])
-            query = "{}sad='{}', sad_confidence={}, ".format(
-                query, data['emotions']['sad']['value'],
-                data['emotions']['sad']['confidence'])
-        else:
-            query = (query + "relaxed=NULL, relaxed_confidence=NULL," +
-                     "party=NULL, party_confidence=NULL," +
-                     "aggressive=NULL, aggressive_confidence=NULL," +
-                     "happy=NULL, happy_confidence=NULL, sad=NULL," +
-                     "sad_confidence=NULL, ")
-
-        if 'loudness' in data:
-            query = "{}peak={}, ".format(query, data['loudness']['peak'])
-            query = "{}loudness_integrated={}, ".format(
-                query, data['loudness']['loudness_integrated'])
-            query = "{}loudness_range={}, ".format(
-                query, data['loudness']['loudness_range'])
-        else:
-            query = (query + "peak=NULL, loudness_integrated=NULL," +
-                     "loudness_range=NULL, ")
-
-        query = query + "last_updated=CURRENT_TIMESTAMP "
-
-        query = ("{}WHERE audio_release={} AND audio_side={}" +
-                 "AND audio_track={}").format(
-            query, ids[0], ids[1], ids[2])
-
-        self._db.query(query)
+        self.upsert([data])
 
     def get_all(self, audio_id: str) -> str:
         """Get all fields for the given audio_id
@@ -0,0 +1,195 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from utilities.config_loader import load_config
+
+
+class AudioCache:
+    """
+    A read-through cache of the analysis data of songs, by audio id and
+    group of fields. Entries are kept in memory, least recently used first
+    out, and expire after a set time.
+
+    When Redis is used, entries are also shared through it, and every song
+    has a version number there that is bumped when its data changes. An
+    entry is only used while the version it was read at is current, so a
+    write in any process invalidates the entries of every process.
+
+    Entries are kept by song rather than by the way its id is written, so
+    01-2-3 and 1-2-3 share their entries.
+
+    Methods
+    -------
+    get(audio_id, group, load)
+        Gets a group of fields of a song, loading it on a miss
+
+    invalidate(audio_id)
+        Drops every cached group of fields of a song
+    """
+
+    def __init__(self, size: int, ttl: float, redis_client=None):
+        self._size = size
+        self._ttl = ttl
+        self._redis = redis_client
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _song(self, audio_id: str) -> str:
+        # The id written without padding, ids that do not parse are kept
+        # as they are
+        try:
+            return '-'.join(map(lambda part: str(int(part)),
+                                audio_id.split('-')))
+        except ValueError:
+            return audio_id
+
+    def _version(self, audio_id: str) -> str:
+        if self._redis is None:
+            return None
+
+        try:
+            version = self._redis.get('audio_version:' + audio_id)
+        except Exception:
+            # Without Redis the version is unknown, so nothing can be
+            # trusted to be current
+            return False
+
+        return version.decode() if version is not None else '0'
+
+    def _get_local(self, key: tuple, version: str):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            value, entry_version, expires = entry
+            if entry_version != version or expires < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def _set_local(self, key: tuple, value, version: str):
+        with self._lock:
+            self._entries[key] = (value, version, time.time() + self._ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def get(self, audio_id: str, group: str, load: Callable):
+        """Gets a group of fields of a song, loading it on a miss
+
+        Parameters
+        ----------
+        audio_id : str
+            The id of the song
+        group : str
+            The name of the group of fields
+        load : Callable
+            Reads the group of fields from the database,
+            called with the audio id
+
+        Returns
+        -------
+        object
+            The group of fields, or None if the song does not exist
+        """
+
+        song = self._song(audio_id)
+
+        version = self._version(song)
+        if version is False:
+            return load(audio_id)
+
+        key = (song, group)
+        value = self._get_local(key, version)
+        if value is not None:
+            return value
+
+        redis_key = 'audio:{}:{}:{}'.format(song, version, group)
+        if self._redis is not None:
+            try:
+                value = self._redis.get(redis_key)
+            except Exception:
+                value = None
+
+            if value is not None:
+                value = json.loads(value.decode())
+                self._set_local(key, value, version)
+                return value
+
+        value = load(audio_id)
+
+        # Songs that do not exist are not cached, so they show up as soon
+        # as they are analyzed
+        if value is None:
+            return None
+
+        self._set_local(key, value, version)
+        if self._redis is not None:
+            try:
+                self._redis.set(redis_key, json.dumps(value),
+                                ex=int(self._ttl))
+            except Exception:
+                pass
+
+        return value
+
+    def invalidate(self, audio_id: str):
+        """Drops every cached group of fields of a song
+
+        Parameters
+        ----------
+        audio_id : str
+            The id of the song
+        """
+
+        song = self._song(audio_id)
+
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == song]:
+                del self._entries[key]
+
+        if self._redis is not None:
+            # Entries of the old version are left to expire
+            try:
+                self._redis.incr('audio_version:' + song)
+            except Exception:
+                # Other processes see the change once their entries expire
+                pass
+
+
+_cache = None
+
+
+def get_audio_cache() -> AudioCache:
+    """Gets the cache of analysis data shared by this process
+
+    Returns
+    -------
+    AudioCache
+        The cache, using Redis if it is enabled in the config
+    """
+
+    global _cache
+
+    if _cache is None:
+        cfg = load_config()
+
+        redis_client = None
+        if cfg['audio_cache_redis']:
+            from redis import Redis
+            redis_client = Redis(host=cfg['redis_host'],
+                                 db=cfg['audio_cache_redis_db'],
+                                 socket_timeout=1)
+
+        _cache = AudioCache(cfg['audio_cache_size'],
+                            cfg['audio_cache_ttl'], redis_client)
+
+    return _cache
@@ -0,0 +1,59 @@
+import os
+import threading
+
+from records import Database
+
+from utilities.config_loader import load_config
+
+
+_database = None
+_database_pid = None
+_lock = threading.Lock()
+
+
+def get_database() -> Database:
+    """Gets the SQL database shared by everything in this process
+
+    The database holds a single engine with a pool of connections, a query
+    checks a connection out of the pool and returns it when it is done.
+    Pools are not safe to use across a fork, so a forked process, like a
+    Celery worker, gets a database of its own the first time it asks.
+
+    Returns
+    -------
+    Database
+        The database for the configured server
+    """
+
+    global _database, _database_pid
+
+    with _lock:
+        if _database is None or _database_pid != os.getpid():
+            cfg = load_config()
+
+            # The connections of the parent process are left alone,
+            # disposing of them here would close them for the parent
+            _database = Database(
+                "{}://{}:{}@{}/{}".format(
+                    cfg['sql_type'], cfg['sql_user'], cfg['sql_pass'],
+                    cfg['sql_host'], cfg['sql_db']),
+                pool_size=cfg['sql_pool_size'],
+                max_overflow=cfg['sql_max_overflow'],
+                pool_recycle=cfg['sql_pool_recycle'],
+                # Checks connections before handing them out, so a
+                # restarted server does not fail the next request
+                pool_pre_ping=True)
+            _database_pid = os.getpid()
+
+        return _database
+
+
+def close_database():
+    """Closes the connections of this process, for use when shutting down"""
+
+    global _database
+
+    with _lock:
+        if _database is not None and _database_pid == os.getpid():
+            _database.close()
+        _database = None
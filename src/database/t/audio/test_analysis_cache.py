@@ -0,0 +1,30 @@
+from database.mongo.audio.analysis_cache import AnalysisCache
+from database.mongo.storinator import Storinator
+
+
+def test_implements_Storinator():
+    ac = AnalysisCache()
+
+    assert isinstance(ac, Storinator)
+
+
+def test_database_name():
+    ac = AnalysisCache()
+
+    assert ac._col == 'analysis_cache'
+
+
+def test_add_and_get():
+    ac = AnalysisCache()
+    ac.add('hash', {'audio_id': '1-1-1', 'BPM': {'value': 120}})
+    ac.add('hash', {'audio_id': '1-1-1', 'BPM': {'value': 130}})
+    entry = ac.get('hash')
+
+    assert entry['audio_id'] == '1-1-1'
+    assert entry['BPM']['value'] == 130
+
+
+def test_get_missing():
+    ac = AnalysisCache()
+
+    assert ac.get('missing') is None
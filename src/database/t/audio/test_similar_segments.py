@@ -0,0 +1,48 @@
+from bson.objectid import ObjectId
+
+from database.mongo.audio.similar_segments import SimilarSegments
+from database.mongo.storinator import Storinator
+
+
+def test_implements_Storinator():
+    ss = SimilarSegments()
+
+    assert isinstance(ss, Storinator)
+
+
+def test_database_name():
+    ss = SimilarSegments()
+
+    assert ss._col == 'similarity_results'
+
+
+def test_add_and_get_overlapping():
+    ss = SimilarSegments()
+    song_id = str(ObjectId())
+    similar = [{'song_id': '2-1-1', 'from_time': 5000,
+                'to_time': 10000, 'distance': 0.5}]
+    ss.add_many([
+        (ObjectId(), song_id, 0, 5000, similar),
+        (ObjectId(), song_id, 5000, 10000, similar),
+        (ObjectId(), song_id, 10000, 15000, similar),
+    ])
+
+    segments = ss.get_overlapping(song_id, 4000, 11000)
+
+    assert list(map(lambda seg: seg['time_from'], segments)) == \
+        [0, 5000, 10000]
+    assert segments[0]['similar'] == similar
+    assert len(ss.get_overlapping(song_id, 5000, 10000)) == 1
+
+
+def test_add_replaces():
+    ss = SimilarSegments()
+    song_id = str(ObjectId())
+    segment_id = ObjectId()
+    ss.add(segment_id, song_id, 0, 5000, [])
+    ss.add(segment_id, song_id, 0, 5000, [{'song_id': '2-1-1'}])
+
+    segments = ss.get(song_id)
+
+    assert len(segments) == 1
+    assert segments[0]['similar'] == [{'song_id': '2-1-1'}]
@@ -1,7 +1,10 @@
-from database.mongo.audio.song_segment import SongSegment
+from database.mongo.audio.song_segment import SongSegment, \
+    encode_array, decode_array
 from database.mongo.storinator import Storinator
 import datetime
 
+import numpy as np
+
 
 def test_implements_Storinator():
     ss = SongSegment()
@@ -17,21 +20,81 @@ def test_database_name():
 
 def test_add_and_get():
     ss = SongSegment()
-    ss.add(1, 0, 5000, None, None, None, None)
+    ss.add(1, 0, 5000, None, None)
     seg = ss.get(1)
 
     assert seg['song_id'] == 1
     assert seg['time_from'] == 0
     assert seg['time_to'] == 5000
-    assert seg['mfcc'] is None
-    assert seg['chroma'] is None
-    assert seg['tempogram'] is None
+    assert seg['feature'] is None
     assert seg['similar'] is None
 
 
+def test_add_feature():
+    ss = SongSegment()
+    feature = np.arange(4, dtype=np.float32)
+    ss.add(2, 0, 5000, feature, [])
+    seg = ss.get(2)
+
+    assert np.array_equal(decode_array(seg['feature']), feature)
+
+
+def test_encode_and_decode_array():
+    array = np.arange(6, dtype=np.float32).reshape(2, 3)
+    decoded = decode_array(encode_array(array))
+
+    assert decoded.dtype == np.float32
+    assert decoded.shape == (2, 3)
+    assert np.array_equal(decoded, array)
+
+
 def test_get_all():
     ss = SongSegment()
-    ss.add(1, 0, 5000, None, None, None, None)
+    ss.add(1, 0, 5000, None, None)
     seg = ss.get_all()
 
     assert len(seg) > 0
+
+
+def test_get_batches():
+    ss = SongSegment()
+    ss.add(1, 0, 5000, None, None)
+    ss.add(1, 5000, 10000, None, None)
+
+    batches = list(ss.get_batches(1, ['song_id']))
+
+    assert len(batches) == ss.count()
+    assert all(map(lambda batch: len(batch) == 1, batches))
+    assert 'time_from' not in batches[0][0]
+    assert batches[0][0]['_id'] < batches[1][0]['_id']
+
+
+def test_get_covering():
+    ss = SongSegment()
+    ss.add(3, 0, 5000, np.arange(4, dtype=np.float32), [])
+    ss.add(3, 5000, 10000, np.arange(4, dtype=np.float32), [])
+    ss.add(3, 10000, 15000, np.arange(4, dtype=np.float32), [])
+
+    seg = ss.get_covering(3, 7000, ['similar'])
+
+    assert seg['time_from'] == 5000
+    assert ss.get_covering(3, 8000, ['similar'])['time_from'] == 5000
+    assert 'feature' not in seg
+    assert ss.get_covering(3, 0)['time_from'] == 0
+    assert ss.get_covering(3, 20000)['time_from'] == 10000
+    assert ss.get_covering(4, 0) is None
+
+
+def test_get_overlapping():
+    ss = SongSegment()
+    ss.add(5, 0, 5000, np.arange(4, dtype=np.float32), [])
+    ss.add(5, 5000, 10000, np.arange(4, dtype=np.float32), [])
+    ss.add(5, 10000, 15000, np.arange(4, dtype=np.float32), [])
+
+    segments = ss.get_overlapping(5, 4000, 11000, ['similar'])
+
+    assert list(map(lambda seg: seg['time_from'], segments)) == \
+        [0, 5000, 10000]
+    assert 'feature' not in segments[0]
+    assert segments[0]['time_to'] == 5000
+    assert len(ss.get_overlapping(5, 5000, 10000)) == 1
@@ -0,0 +1,82 @@
+from database.sql.audio_cache import AudioCache
+
+
+class _Loader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self, audio_id):
+        self.calls += 1
+        return self.value
+
+
+def test_cache_hit():
+    cache = AudioCache(10, 60)
+    load = _Loader({'bpm': 120})
+
+    assert cache.get('1-2-3', 'bpm', load) == {'bpm': 120}
+    assert cache.get('1-2-3', 'bpm', load) == {'bpm': 120}
+    assert load.calls == 1
+
+
+def test_invalidate():
+    cache = AudioCache(10, 60)
+    load = _Loader({'bpm': 120})
+
+    cache.get('1-2-3', 'bpm', load)
+    cache.get('1-2-3', 'timbre', load)
+    cache.invalidate('1-2-3')
+    load.value = {'bpm': 121}
+
+    assert cache.get('1-2-3', 'bpm', load) == {'bpm': 121}
+    assert load.calls == 3
+
+
+def test_missing_song_is_not_cached():
+    cache = AudioCache(10, 60)
+    load = _Loader(None)
+
+    assert cache.get('1-2-3', 'bpm', load) is None
+    assert cache.get('1-2-3', 'bpm', load) is None
+    assert load.calls == 2
+
+
+def test_least_recently_used_is_evicted():
+    cache = AudioCache(2, 60)
+    load = _Loader({'bpm': 120})
+
+    cache.get('1-1-1', 'bpm', load)
+    cache.get('1-1-2', 'bpm', load)
+    cache.get('1-1-1', 'bpm', load)
+    cache.get('1-1-3', 'bpm', load)
+    assert load.calls == 3
+
+    cache.get('1-1-1', 'bpm', load)
+    assert load.calls == 3
+
+    cache.get('1-1-2', 'bpm', load)
+    assert load.calls == 4
+
+
+def test_expired_entries_are_reloaded():
+    cache = AudioCache(10, 0)
+    load = _Loader({'bpm': 120})
+
+    cache.get('1-2-3', 'bpm', load)
+    cache.get('1-2-3', 'bpm', load)
+
+    assert load.calls == 2
+
+
+def test_invalidate_other_spelling():
+    cache = AudioCache(10, 60)
+    load = _Loader({'bpm': 120})
+
+    cache.get('01-2-3', 'bpm', load)
+    cache.invalidate('1-2-3')
+    load.value = {'bpm': 121}
+
+    assert cache.get('01-2-3', 'bpm', load) == {'bpm': 121}
+    assert cache.get('1-02-3', 'bpm', load) == {'bpm': 121}
+    assert load.calls == 2
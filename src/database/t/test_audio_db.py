@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from database.sql.audio import AudioDB, _columns, _upsert_query
+
+
+def test_columns_of_supplied_groups_only():
+    data = {
+        'audio_id': '1-2-3',
+        'BPM': {'value': 120, 'confidence': 0.9},
+        'loudness': {'peak': -1.0, 'loudness_integrated': -9.0,
+                     'loudness_range': 4.0},
+    }
+
+    assert _columns(data) == {
+        'bpm': 120,
+        'bpm_confidence': 0.9,
+        'peak': -1.0,
+        'loudness_integrated': -9.0,
+        'loudness_range': 4.0,
+    }
+
+
+def test_upsert_query_binds_parameters():
+    query = _upsert_query('postgresql', ('bpm', 'bpm_confidence'))
+
+    assert "VALUES (:rel, :side, :track, :bpm, :bpm_confidence)" in query
+    assert "ON CONFLICT (audio_release, audio_side, audio_track)" in query
+    assert "bpm=EXCLUDED.bpm" in query
+    assert "timbre" not in query
+
+
+def test_upsert_query_mysql():
+    query = _upsert_query('mysql', ('peak',))
+
+    assert "ON DUPLICATE KEY UPDATE peak=VALUES(peak)" in query
+
+
+def test_get_many_unknown_group():
+    with pytest.raises(ValueError):
+        AudioDB().get_many(['1-2-3'], ['rhythm', 'tempo'])
+
+
+class _Rows:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def export(self, format):
+        return json.dumps(self._rows)
+
+
+class _Database:
+    def __init__(self, rows):
+        self.rows = rows
+        self.params = []
+
+    def query(self, query, fetchall=False, **params):
+        self.params.append(params)
+        return _Rows(self.rows)
+
+
+def test_get_many_skips_malformed_ids(monkeypatch):
+    database = _Database([{'audio_release': 1, 'audio_side': 2,
+                           'audio_track': 3, 'bpm': 120}])
+    monkeypatch.setattr('database.sql.audio.get_database', lambda: database)
+
+    results = AudioDB().get_many(['1-2-3', 'a-b-c', '1-2', '01-2-3'],
+                                 ['rhythm'])
+
+    assert set(results.keys()) == {'1-2-3', '01-2-3'}
+    assert results['01-2-3']['bpm'] == 120
+    assert database.params == [{'rel0': 1, 'side0': 2, 'track0': 3}]
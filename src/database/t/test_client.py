@@ -0,0 +1,23 @@
+import os
+
+import database.mongo.client as client
+from database.mongo.client import get_client, close_clients
+
+
+def test_client_is_shared():
+    assert get_client() is get_client()
+    assert get_client('dr') is get_client('dr')
+    assert get_client() is not get_client('dr')
+
+    close_clients()
+
+
+def test_forked_process_gets_new_client(monkeypatch):
+    parent_client = get_client()
+
+    pid = os.getpid()
+    monkeypatch.setattr(client.os, 'getpid', lambda: pid + 1)
+
+    assert get_client() is not parent_client
+
+    close_clients()
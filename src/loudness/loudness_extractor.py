@@ -1,8 +1,10 @@
 import sys
 from typing import Tuple
 
+import numpy as np
 from essentia import run, Pool
 from essentia.standard import RhythmExtractor2013
+from essentia.standard import LoudnessEBUR128 as StandardLoudnessEBUR128
 from essentia.streaming import LoudnessEBUR128
 
 
@@ -43,3 +45,31 @@ def get_song_loudness(audio) -> Tuple[float, float, float]:
     max_loudness = max(*p["momentaryLoudness"], *p["shortTermLoudness"]) * 1.0
 
     return max_loudness, p["integratedLoudness"], p["loudnessRange"]
+
+
+def get_decoded_song_loudness(
+        audio, sample_rate: int = 44100) -> Tuple[float, float, float]:
+    """Extracts the loudness data for the given decoded stereo audio
+
+    Parameters
+    ----------
+    audio
+        Decoded stereo audio
+    sample_rate : int, optional
+        The sample rate of the audio
+
+    Returns
+    -------
+    Tuple[float, float, float]
+        A tuple of the song's loudness values
+    """
+
+    momentary, short_term, integrated, loudness_range = \
+        StandardLoudnessEBUR128(hopSize=0.1, sampleRate=sample_rate)(
+            np.ascontiguousarray(audio, dtype=np.float32))
+
+    # Essentia had 2 methods of determining the loudness or DBFS of a clip
+    # we use the max value of either method
+    max_loudness = max(*momentary, *short_term) * 1.0
+
+    return max_loudness, integrated, loudness_range
@@ -1,5 +1,7 @@
-from loudness.loudness_extractor import get_song_loudness
-from utilities.filehandler.audio_loader import get_audio_loaded_song
+from loudness.loudness_extractor import get_song_loudness, \
+    get_decoded_song_loudness
+from utilities.filehandler.audio_loader import get_audio_loaded_song, \
+    decode_song, get_decoded_song
 
 
 def test_get_song_loudness():
@@ -10,3 +12,16 @@ def test_get_song_loudness():
     assert round(float(max_loudness), 5) == -6.05837
     assert round(float(integratedLoudness), 5) == -9.10699
     assert loudnessRange == 10.448598861694336
+
+
+def test_get_decoded_song_loudness(tmp_path):
+    path, sample_rate = decode_song(
+        "loudness/t/test_loudness_extractor/8376-1-" +
+        "1_Demolition_Man_proud_music_preview.wav", str(tmp_path))
+    max_loudness, integratedLoudness, loudnessRange = \
+        get_decoded_song_loudness(get_decoded_song(path), sample_rate)
+
+    assert sample_rate == 44100
+    assert round(float(max_loudness), 2) == -6.06
+    assert round(float(integratedLoudness), 2) == -9.11
+    assert round(float(loudnessRange), 2) == 10.45
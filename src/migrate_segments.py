@@ -0,0 +1,5 @@
+from similarity.similarity import migrate_segment_features, \
+    publish_all_similar
+
+migrate_segment_features()
+publish_all_similar()
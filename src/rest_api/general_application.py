@@ -1,20 +1,27 @@
 import os
 import json
+import hashlib
 import datetime
 
 import requests
 from flask import Flask
 from flask import request
+from flask import Response
 from flask_restplus import Resource, Api, fields
+from werkzeug.http import http_date
 
-from database.sql.audio import AudioDB
+from database.sql.audio import AudioDB, FIELD_GROUPS
+from database.sql.audio_cache import get_audio_cache
 from database.mongo.video.video_emotion import VideoEmotion
 from database.mongo.video.video_emotion_no_song import VideoEmotionNS
-from similarity.similarity import query_similar
+from similarity.similarity import query_similar, query_similar_range
 from utilities.config_loader import load_config
 
 cfg = load_config()
 
+# The most ids a single batch request may ask for
+BATCH_MAX_IDS = cfg.get('audio_batch_max_ids', 10000)
+
 app = Flask(__name__)
 api = Api(app)
 
@@ -30,6 +37,23 @@ song_fields = api.model('SongModel', {
         required=False)
 })
 
+"""
+    Models a request for the analysis data of many songs at once
+"""
+batch_fields = api.model('BatchModel', {
+    'ids': fields.List(
+        fields.String,
+        description='The IDs of the songs to retrieve, at most ' +
+        str(BATCH_MAX_IDS),
+        required=True),
+    'fields': fields.List(
+        fields.String,
+        description=('The groups of fields to retrieve, any of ' +
+                     ', '.join(FIELD_GROUPS.keys()) +
+                     '. Every group is retrieved if left out'),
+        required=False),
+})
+
 """
     Models the time-range of a video input
 """
@@ -107,6 +131,90 @@ class AnalyzeSong(Resource):
         return resp.json(), resp.status_code
 
 
+@api.route('/audio/jobs/<string:job_id>')
+class GetIngestionJob(Resource):
+    def get(self, job_id: str) -> object:
+        """Forwards a request for the progress of adding a folder
+        to the pipeline to the audio API
+
+        Parameters
+        ----------
+        job_id : str
+            The id of the job returned when the folder was posted
+
+        Returns
+        -------
+        object
+            A json object containing the state of the job
+        """
+
+        resp = requests.get(
+            cfg['rest_api_music_url'] + "/audio/jobs/" + job_id)
+
+        return resp.json(), resp.status_code
+
+
+@api.route('/audio/batch')
+class GetAnalyzedSongs(Resource):
+    @api.expect(batch_fields)
+    def post(self) -> object:
+        """Retrieves previously analyzed songs' data from the database
+
+        Returns
+        -------
+        object
+            A json object containing the information of the analyzed
+            songs by ID, and a list of the IDs that do not seem to exist
+        """
+
+        audio_ids, groups = check_batch(request.get_json())
+
+        results = AudioDB().get_many(audio_ids, groups)
+
+        return {
+            'results': results,
+            'missing': list(filter(
+                lambda audio_id: audio_id not in results, audio_ids)),
+        }
+
+
+@api.route('/audio/batch/stream')
+class StreamAnalyzedSongs(Resource):
+    @api.expect(batch_fields)
+    def post(self) -> object:
+        """Retrieves previously analyzed songs' data from the database,
+        streaming it as it is read
+
+        Returns
+        -------
+        object
+            Newline-delimited json, with one object per requested ID
+            containing the information of the analyzed song,
+            or an error if the ID does not seem to exist
+        """
+
+        audio_ids, groups = check_batch(request.get_json())
+
+        def stream():
+            db_connection = AudioDB()
+
+            # Read in the same chunks as the database is queried, so the
+            # first songs are sent before the last are read
+            for start in range(0, len(audio_ids), 1000):
+                chunk = audio_ids[start:start + 1000]
+                results = db_connection.get_many(chunk, groups)
+
+                for audio_id in chunk:
+                    line = results.get(audio_id, {
+                        'error': "The given id '{}' does not seem to exist"
+                        .format(audio_id)
+                    })
+                    line['audio_id'] = audio_id
+                    yield json.dumps(line) + "\n"
+
+        return Response(stream(), mimetype='application/x-ndjson')
+
+
 @api.route('/audio/<string:diskotek_nr>')
 class GetAnalyzedSong(Resource):
     def get(self, diskotek_nr: str) -> object:
@@ -123,13 +231,8 @@ class GetAnalyzedSong(Resource):
             A json object containing the information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_all(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'all', AudioDB().get_all)
 
 
 @api.route('/audio/rhythm/<string:diskotek_nr>')
@@ -149,13 +252,8 @@ class GetAnalyzedSongRhythm(Resource):
             information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_rhythm(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'rhythm', AudioDB().get_rhythm)
 
 
 @api.route('/audio/rhythm/bpm/<string:diskotek_nr>')
@@ -174,13 +272,8 @@ class GetAnalyzedSongBPM(Resource):
             A json object containing the BPM information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_bpm(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'bpm', AudioDB().get_bpm)
 
 
 @api.route('/audio/timbre/<string:diskotek_nr>')
@@ -200,13 +293,8 @@ class GetAnalyzedSongTimbre(Resource):
             information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_timbre(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'timbre', AudioDB().get_timbre)
 
 
 @api.route('/audio/emotions/<string:diskotek_nr>')
@@ -226,13 +314,8 @@ class GetAnalyzedSongEmotions(Resource):
             information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_emotions(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'emotions', AudioDB().get_emotions)
 
 
 @api.route('/audio/emotions/relaxed/<string:diskotek_nr>')
@@ -252,13 +335,8 @@ class GetAnalyzedSongEmotionsRelaxed(Resource):
             information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_relaxed(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'relaxed', AudioDB().get_relaxed)
 
 
 @api.route('/audio/emotions/party/<string:diskotek_nr>')
@@ -277,13 +355,8 @@ class GetAnalyzedSongEmotionsParty(Resource):
             A json object containing the party information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_party(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'party', AudioDB().get_party)
 
 
 @api.route('/audio/emotions/aggressive/<string:diskotek_nr>')
@@ -303,13 +376,8 @@ class GetAnalyzedSongEmotionsAggressive(Resource):
             information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_aggressive(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'aggressive', AudioDB().get_aggressive)
 
 
 @api.route('/audio/emotions/happy/<string:diskotek_nr>')
@@ -328,13 +396,8 @@ class GetAnalyzedSongEmotionsHappy(Resource):
             A json object containing the happy information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_happy(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'happy', AudioDB().get_happy)
 
 
 @api.route('/audio/emotions/sad/<string:diskotek_nr>')
@@ -353,13 +416,8 @@ class GetAnalyzedSongEmotionsSad(Resource):
             A json object containing the sad information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_sad(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'sad', AudioDB().get_sad)
 
 
 @api.route('/audio/levels/<string:diskotek_nr>')
@@ -379,13 +437,8 @@ class GetAnalyzedSongMeter(Resource):
             information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_level(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'level', AudioDB().get_level)
 
 
 @api.route('/audio/levels/peak/<string:diskotek_nr>')
@@ -404,13 +457,8 @@ class GetAnalyzedSongMeterPeak(Resource):
             A json object containing the peak information of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_peak(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'peak', AudioDB().get_peak)
 
 
 @api.route('/audio/levels/loudness_integrated/<string:diskotek_nr>')
@@ -431,13 +479,9 @@ class GetAnalyzedSongMeterLoudnessIntegrated(Resource):
             integrated of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_loudness_integrated(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'loudness_integrated',
+            AudioDB().get_loudness_integrated)
 
 
 @api.route('/audio/levels/loudness_range/<string:diskotek_nr>')
@@ -458,13 +502,8 @@ class GetAnalyzedSongMeterLoudnessRange(Resource):
             loudness range of the analyzed song
         """
 
-        db_connection = AudioDB()
-
-        result = db_connection.get_loudness_range(diskotek_nr)
-
-        check_if_none(result, diskotek_nr)
-
-        return result
+        return cached_response(
+            diskotek_nr, 'loudness_range', AudioDB().get_loudness_range)
 
 
 @api.route('/video')
@@ -503,6 +542,29 @@ class AnalyzeVideo(Resource):
         return resp.json(), resp.status_code
 
 
+@api.route('/video/jobs/<string:job_id>')
+class GetVideoJob(Resource):
+    def get(self, job_id: str) -> object:
+        """Forwards a request for the state of a video analysis
+        to the video API
+
+        Parameters
+        ----------
+        job_id : str
+            The id of the job returned when the video was posted
+
+        Returns
+        -------
+        object
+            A json object containing the state of the job
+        """
+
+        resp = requests.get(
+            cfg['rest_api_video_url'] + "/video/jobs/" + job_id)
+
+        return resp.json(), resp.status_code
+
+
 @api.route('/video/<string:video_id>')
 class GetAnalyzedVideo(Resource):
     def get(self, video_id: str) -> object:
@@ -626,6 +688,83 @@ class Similar(Resource):
         return similar
 
 
+@api.route('/similarity/range/<string:diskotek_nr>/<int:from_time>/' +
+           '<int:to_time>')
+class SimilarRange(Resource):
+    def get(self, diskotek_nr: str, from_time: int, to_time: int) -> object:
+        """Retrieves the similarity data of every segment of a previously
+        analyzed song that overlaps the time range
+
+        Parameters
+        ----------
+        diskotek_nr : str
+            The diskotek ID of the song
+        from_time : int
+            The start of the time range, in milliseconds
+        to_time: int
+            The end of the time range, in milliseconds
+
+        Returns
+        -------
+        object
+            A json list of the overlapping segments, with the time range
+            and the similar segments of each
+        """
+
+        segments = query_similar_range(diskotek_nr, from_time, to_time)
+
+        if segments is None:
+            # Should be 404, but restplus inserts additional text
+            api.abort(400, 'No segments found')
+
+        return segments
+
+
+def cached_response(diskotek_nr: str, group: str, load) -> object:
+    result = get_audio_cache().get(diskotek_nr, group, load)
+
+    check_if_none(result, diskotek_nr)
+
+    # The result includes when it was last updated, so the tag changes
+    # whenever the song is analyzed again
+    etag = hashlib.sha1(
+        json.dumps(result, sort_keys=True).encode()).hexdigest()
+    headers = {'ETag': '"{}"'.format(etag)}
+
+    last_modified = last_updated(result)
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+
+    # If-Modified-Since is only used by clients that send no ETag
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = (last_modified is not None and
+                        request.if_modified_since is not None and
+                        last_modified <= request.if_modified_since
+                        .replace(tzinfo=None))
+
+    if not_modified:
+        return Response(status=304, headers=headers)
+
+    return result, 200, dict(headers, **{'Cache-Control': 'no-cache'})
+
+
+def last_updated(result):
+    # When the song was last analyzed, in UTC to the second as HTTP dates
+    # are, or None if the result does not tell
+    value = result.get('last_updated') or result.get('Last_Updated')
+
+    if not isinstance(value, str):
+        return None
+
+    try:
+        return datetime.datetime.strptime(
+            value[:19].replace(' ', 'T'), '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+
+
 def check_if_none(result, diskotek_nr):
     if result is None:
         api.abort(
@@ -636,6 +775,47 @@ def check_if_none(result, diskotek_nr):
     return
 
 
+def check_batch(data):
+    if not isinstance(data, dict) or not isinstance(data.get('ids'), list):
+        api.abort(
+            400,
+            "A list of ids is required"
+        )
+
+    if not all(map(lambda audio_id: isinstance(audio_id, str), data['ids'])):
+        api.abort(
+            400,
+            "Every id must be a string"
+        )
+
+    if len(data['ids']) > BATCH_MAX_IDS:
+        api.abort(
+            400,
+            "At most {} ids can be requested at once".format(BATCH_MAX_IDS)
+        )
+
+    groups = data.get('fields')
+
+    if groups is not None:
+        if not isinstance(groups, list) or \
+                not all(map(lambda group: isinstance(group, str), groups)):
+            api.abort(
+                400,
+                "The fields must be a list of strings"
+            )
+
+        unknown = set(groups) - set(FIELD_GROUPS.keys())
+
+        if len(unknown) > 0:
+            api.abort(
+                400,
+                "The given fields '{}' do not seem to exist"
+                .format(", ".join(sorted(unknown)))
+            )
+
+    return data['ids'], groups
+
+
 def format_date(result):
     date = datetime.datetime.strptime(
             result['Last_Updated'], '%Y-%m-%dT%H:%M:%S')
@@ -4,12 +4,10 @@ import json
 from flask import Flask
 from flask import request
 from flask_restplus import Resource, Api, fields
-from celery import chain
 
-from tasks import check_done, add_bpm, add_emotions, add_metering, \
-    add_similarity_features
+from tasks import app as celery_app, ingest_directory, is_song, make_song, \
+    song_pipeline
 from utilities.config_loader import load_config
-from utilities.get_song_id import get_song_id
 
 
 cfg = load_config()
@@ -27,39 +25,27 @@ song_fields = api.model('SongModel', {
         required=True),
     'force': fields.Boolean(
         description='Should every analysis run',
+        required=False),
+    'fused': fields.Boolean(
+        description='Should every analysis run in a single task, ' +
+        'defaults to the configured pipeline mode',
         required=False)
 })
 
 
-pipeline = chain(
-    check_done.s().set(priority=1),
-    add_bpm.s().set(priority=2),
-    add_emotions.s().set(priority=3),
-    add_metering.s().set(priority=4),
-    add_similarity_features.s().set(priority=5),
-)
-
-
 def add_to_pipeline(data, song_path):
-    if song_path.endswith(("mp3", "wav")):
-        id = get_song_id(song_path)
-        force = data['force'] if 'force' in data else False
-        config = data['config'] if 'config' in data else {}
-        song = dict({
-            'audio_id': id,
-            'source_path': song_path,
-            'FORCE': force,
-            'config': config,
-        })
+    if is_song(song_path):
+        song = make_song(data, song_path)
 
-        pipeline.delay(song)
+        song_pipeline(data).delay(song)
 
 
 @api.route('/audio')
 class AnalyzeSong(Resource):
     @api.expect(song_fields)
     def post(self) -> str:
-        """Analyzes a song and outputs the data to the database
+        """Analyzes a song, or every song in a folder,
+        and outputs the data to the database
         """
 
         data = request.get_json()
@@ -67,19 +53,50 @@ class AnalyzeSong(Resource):
 
         if os.path.isfile(song_path):
             add_to_pipeline(data, song_path)
-        else:  # Is folder
-            for outer_name in os.listdir(song_path):
-                outer_filename = os.path.join(song_path, outer_name)
-
-                if os.path.isfile(outer_filename):
-                    add_to_pipeline(data, outer_filename)
-                else:
-                    for inner_name in os.listdir(outer_filename):
-                        inner_filename = os.path.join(
-                            outer_filename, inner_name)
-
-                        if os.path.isfile(inner_filename):
-                            add_to_pipeline(data, inner_filename)
-
-        return {'Response': 'The song has been added to the pipeline ' +
-                'and will be available once analyzed'}, 201
+
+            return {'Response': 'The song has been added to the pipeline ' +
+                    'and will be available once analyzed'}, 201
+
+        if not os.path.isdir(song_path):
+            api.abort(
+                400,
+                "The given source path '{}' does not seem to exist"
+                .format(song_path)
+            )
+
+        # Folders are scanned in the background, as they may be large
+        job = ingest_directory.apply_async((data,), priority=0)
+
+        return {'Response': 'The songs in the folder are being added to ' +
+                'the pipeline and will be available once analyzed',
+                'job_id': job.id}, 202
+
+
+@api.route('/audio/jobs/<string:job_id>')
+class IngestionJob(Resource):
+    def get(self, job_id: str) -> object:
+        """Retrieves the progress of adding a folder to the pipeline
+
+        Parameters
+        ----------
+        job_id : str
+            The id of the job returned when the folder was posted
+
+        Returns
+        -------
+        object
+            A json object containing the state of the job
+            and the number of songs found, enqueued and
+            skipped as already analyzed so far
+        """
+
+        job = celery_app.AsyncResult(job_id)
+
+        result = dict({'job_id': job_id, 'state': job.state})
+
+        if job.failed():
+            result['error'] = str(job.info)
+        elif isinstance(job.info, dict):
+            result.update(job.info)
+
+        return result
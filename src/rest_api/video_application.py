@@ -1,6 +1,5 @@
 import os
 import json
-import _thread
 
 from flask import Flask
 from flask import request
@@ -9,6 +8,7 @@ from flask_restplus import Resource, Api, fields
 from utilities.config_loader import load_config
 from video_emotion.api_helper import process_data_and_extract_emotions, \
     process_data_and_extract_emotions_with_song
+from video_emotion.job_scheduler import JobScheduler
 
 
 cfg = load_config()
@@ -16,6 +16,10 @@ cfg = load_config()
 app = Flask(__name__)
 api = Api(app)
 
+# Bounds how many videos are analyzed at once, and how many may be waiting
+scheduler = JobScheduler(cfg['video_max_workers'],
+                         cfg['video_max_pending_jobs'])
+
 """
     Models the time-range of a video input
 """
@@ -79,7 +83,8 @@ class AnalyzeVideo(Resource):
         Returns
         -------
         object
-            A dummy json response to confirm that the analysis has begun
+            A json response to confirm that the analysis has begun,
+            containing the id of the job to follow it with
         """
 
         data = request.get_json()
@@ -92,18 +97,13 @@ class AnalyzeVideo(Resource):
 
         check_if_none(video_path)
 
-        _thread.start_new_thread(
+        return start_job(
             process_data_and_extract_emotions,
-            (
-                video_id,
-                video_path,
-                video_time_range
-            )
+            video_id,
+            video_path,
+            video_time_range
         )
 
-        return {'Response': 'The request is being processed and will be' +
-                'available in the database when done.'}
-
 
 @api.route('/video_with_audio')
 class AnalyzeVideoWithSong(Resource):
@@ -114,7 +114,8 @@ class AnalyzeVideoWithSong(Resource):
         Returns
         -------
         object
-            A dummy json response to confirm that the analysis has begun
+            A json response to confirm that the analysis has begun,
+            containing the id of the job to follow it with
         """
 
         data = request.get_json()
@@ -128,19 +129,55 @@ class AnalyzeVideoWithSong(Resource):
 
         check_if_none(video_path)
 
-        _thread.start_new_thread(
+        return start_job(
             process_data_and_extract_emotions_with_song,
-            (
-                video_id,
-                video_path,
-                video_time_range,
-                song_id
-            )
+            video_id,
+            video_path,
+            video_time_range,
+            song_id
         )
 
-        return {'Response': 'The request is being processed and will be' +
-                'available in the database when done.'}
 
+@api.route('/video/jobs/<string:job_id>')
+class VideoJob(Resource):
+    def get(self, job_id: str) -> object:
+        """Retrieves the state of a video analysis
+
+        Parameters
+        ----------
+        job_id : str
+            The id of the job returned when the video was posted
+
+        Returns
+        -------
+        object
+            A json object containing the state of the job
+        """
+
+        result = scheduler.status(job_id)
+
+        if result is None:
+            api.abort(
+                404,
+                "The given job id '{}' does not seem to exist"
+                .format(job_id)
+            )
+
+        return result
+
+
+def start_job(function, *args) -> object:
+    job_id = scheduler.submit(function, *args)
+
+    if job_id is None:
+        api.abort(
+            429,
+            "Too many videos are being analyzed, try again later"
+        )
+
+    return {'Response': 'The request is being processed and will be ' +
+            'available in the database when done.',
+            'job_id': job_id}, 202
 
 
 def check_if_invalid_time_range(video_time_range):
@@ -0,0 +1,79 @@
+import sys
+import time
+import tempfile
+from multiprocessing import cpu_count
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from similarity.index import SimilarityIndex
+from similarity.exact import exact_matches
+from similarity.similarity import _lsh_matches, MATCHES, MEMORY_BUDGET
+
+
+def _synthetic_segments(count: int, dimension: int, songs: int):
+    """ Creates segments of random songs, the
+    segments of a song lie close together the
+    way segments of real songs tend to
+    """
+
+    rng = np.random.RandomState(5721840)
+    centers = rng.rand(songs, dimension).astype(np.float32)
+    song = rng.randint(0, songs, count)
+    features = centers[song] + rng.normal(
+        0, 0.05, (count, dimension)).astype(np.float32)
+
+    return list(map(lambda i: (ObjectId(), str(song[i]), i, features[i]),
+                    range(count)))
+
+
+def _recall(found, expected) -> float:
+    """ The share of the exact matches
+    that were found
+    """
+
+    hits = 0
+    total = 0
+    for found_matches, expected_matches in zip(found, expected):
+        expected_rows = set(map(lambda m: m[0], expected_matches))
+        hits += len(expected_rows & set(map(lambda m: m[0], found_matches)))
+        total += len(expected_rows)
+
+    return hits / max(1, total)
+
+
+def benchmark(count: int, queries: int, dimension: int):
+    """ Compares the recall and throughput of
+    the LSH and exact similarity engines on
+    random segments
+    """
+
+    segments = _synthetic_segments(count, dimension, max(1, count // 50))
+
+    with tempfile.TemporaryDirectory() as path:
+        index = SimilarityIndex(path)
+        index.append(segments)
+
+        segs = segments[:queries]
+
+        start = time.time()
+        exact = exact_matches(index, segs, MATCHES, MEMORY_BUDGET,
+                              cpu_count())
+        exact_time = time.time() - start
+
+        start = time.time()
+        lsh = _lsh_matches(index, segs)
+        lsh_time = time.time() - start
+
+    print("{} segments of {} dimensions, {} queries".format(
+        count, dimension, queries))
+    print("exact: {:.2f}s, {:.0f} queries/s, recall 1.00".format(
+        exact_time, queries / exact_time))
+    print("lsh:   {:.2f}s, {:.0f} queries/s, recall {:.2f}".format(
+        lsh_time, queries / lsh_time, _recall(lsh, exact)))
+
+
+if __name__ == '__main__':
+    # Usage: python -m similarity.benchmark [segments] [queries] [dimension]
+    args = list(map(int, sys.argv[1:]))
+    benchmark(*(args + [20000, 1000, 512][len(args):]))
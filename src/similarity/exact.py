@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def exact_matches(index, segs, count: int, memory_budget: int,
+                  workers: int) -> list:
+    """Finds the exact n nearest segments in the index for every segment,
+    by computing the distances to every row of the index as blocked
+    matrix multiplications
+
+    Distances are computed as ||a||^2 + ||b||^2 - 2ab for a tile of index
+    rows and a chunk of segments at a time, so a single matrix product
+    does the bulk of the work. The tiles are sized to keep the job within
+    the memory budget, and the chunks of segments are spread over worker
+    threads, as numpy releases the GIL while multiplying.
+
+    Parameters
+    ----------
+    index : SimilarityIndex
+        The index to search
+    segs : list of Tuple[id, song_id: str, time: int, feature]
+        The segments to find matches for
+    count : int
+        The number of matches to find for every segment
+    memory_budget : int
+        The number of bytes the search may use at once
+    workers : int
+        The number of threads to search with
+
+    Returns
+    -------
+    list of list of Tuple[row: int, distance: float]
+        The matches of every segment ordered by distance, matches from the
+        song a segment originates from are left out
+    """
+
+    if len(segs) == 0 or len(index) == 0:
+        return list(map(lambda x: [], segs))
+
+    queries = np.array(list(map(lambda seg: seg[3], segs)), dtype=np.float32)
+    song_ids = np.array(list(map(lambda seg: seg[1].encode(), segs)))
+    query_norms = np.einsum('ij,ij->i', queries, queries)
+
+    dimension = index.dimension
+    workers = max(1, workers)
+
+    # Half the budget holds the tile of the index, the rest is shared by
+    # the workers for their distance matrices
+    tile = int(max(1, min(len(index),
+                          memory_budget // 2 // (dimension * 4))))
+    chunk = int(max(1, memory_budget // 2 // workers // (tile * 4 * 3)))
+
+    best_rows = np.full((len(segs), count), -1, dtype=np.int64)
+    best_dists = np.full((len(segs), count), np.inf, dtype=np.float32)
+
+    def search(start, data, norms, rows, excluded, tile_song_ids):
+        end = start + chunk
+
+        dists = data @ queries[start:end].T
+        dists *= -2
+        dists += norms[:, np.newaxis]
+        dists += query_norms[np.newaxis, start:end]
+        dists = dists.T
+
+        # Deleted rows and rows from the same song are not valid matches
+        dists[:, excluded] = np.inf
+        dists[song_ids[start:end, np.newaxis] ==
+              tile_song_ids[np.newaxis, :]] = np.inf
+
+        # Only the best of the tile can make it into the best overall
+        k = min(count, dists.shape[1])
+        lowest = np.argpartition(dists, k - 1, axis=1)[:, :k]
+
+        merged_rows = np.concatenate(
+            (best_rows[start:end], rows[lowest]), axis=1)
+        merged_dists = np.concatenate(
+            (best_dists[start:end],
+             np.take_along_axis(dists, lowest, axis=1)), axis=1)
+
+        lowest = np.argpartition(merged_dists, count - 1, axis=1)[:, :count]
+        best_rows[start:end] = np.take_along_axis(merged_rows, lowest, axis=1)
+        best_dists[start:end] = np.take_along_axis(
+            merged_dists, lowest, axis=1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for tile_start in range(0, len(index), tile):
+            tile_end = min(tile_start + tile, len(index))
+
+            data = np.ascontiguousarray(index.features[tile_start:tile_end])
+            norms = np.einsum('ij,ij->i', data, data)
+            rows = np.arange(tile_start, tile_end)
+            segments = index.segments[tile_start:tile_end]
+            excluded = np.asarray(segments['deleted'])
+            tile_song_ids = np.asarray(segments['song_id'])
+
+            list(executor.map(
+                lambda start: search(start, data, norms, rows, excluded,
+                                     tile_song_ids),
+                range(0, len(segs), chunk)))
+
+    best = []
+    for i in range(0, len(segs)):
+        found = np.isfinite(best_dists[i])
+        rows = best_rows[i][found]
+
+        # The expanded form loses precision for close vectors, so the
+        # distances of the matches are computed directly
+        diff = index.features[np.sort(rows)] - queries[i]
+        dists = dict(zip(np.sort(rows).tolist(),
+                         np.sqrt(np.einsum('ij,ij->i', diff, diff)).tolist()))
+
+        best.append(sorted(map(lambda row: (row, dists[row]), rows.tolist()),
+                           key=lambda match: match[1]))
+
+    return best
@@ -0,0 +1,427 @@
+import os
+import json
+import fcntl
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+from bson.objectid import ObjectId
+
+
+# Bump whenever the on-disk layout or the feature vectors change, an index
+# with another version is discarded and rebuilt from the database
+INDEX_VERSION = 3
+
+# The index is compacted once more than this share of its rows, and more
+# than the minimum number of rows, are deleted
+COMPACT_RATIO = 0.25
+COMPACT_MINIMUM = 10000
+
+# The number of rows copied at a time while compacting
+_COMPACT_CHUNK = 65536
+
+# Song ids are stored in a fixed width field
+SONG_ID_LENGTH = 32
+
+SEGMENT_DTYPE = np.dtype([
+    ('id', 'S12'),
+    ('song_id', 'S{}'.format(SONG_ID_LENGTH)),
+    ('time', '<i8'),
+    ('deleted', '?'),
+])
+
+_META_FILE = 'meta.json'
+_FEATURES_FILE = 'features.{}.f32'
+_SEGMENTS_FILE = 'segments.{}.bin'
+_RUN_FILE = 'ids.{}.bin'
+_LOCK_FILE = '.lock'
+
+
+class SimilarityIndex:
+    """
+    A persistent, versioned store of the segment feature vectors used for
+    similarity lookup. Features are kept in a single float32 matrix on disk,
+    which is memory-mapped when opened and only ever appended to, so adding
+    new segments costs time proportional to the new segments only.
+
+    The rows of the ids in the index are kept in sorted runs, each run at
+    most half as long as the one before it, so the rows an append replaces
+    are found by binary search rather than by scanning every id.
+
+    Replaced rows are only marked as deleted, once they make up too much of
+    the index the live rows are copied to a new generation of the data files.
+    Readers keep the generation they mapped until they refresh.
+
+    Methods
+    -------
+    refresh()
+        Re-reads the index from disk to pick up rows appended by others
+
+    append(segments)
+        Appends segments to the index, replacing rows with the same id
+
+    compact()
+        Drops the deleted rows from the index
+
+    reset(projection)
+        Removes every row from the index
+
+    segment(row)
+        Gets a single row as a segment tuple
+
+    bucket(number, size)
+        Gets the live rows and features of a bucket of the index
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+
+        self.refresh()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def dimension(self) -> int:
+        """The length of the feature vectors in the index"""
+
+        return self._dimension
+
+    @property
+    def projection(self) -> str:
+        """The key of the projection applied to the features in the index,
+        or None if they are not projected"""
+
+        return self._projection
+
+    @property
+    def features(self):
+        """The memory-mapped feature matrix of the index"""
+
+        return self._features
+
+    @property
+    def segments(self):
+        """The memory-mapped segment records of the index"""
+
+        return self._segments
+
+    def _file(self, name: str, generation: int = None) -> str:
+        if generation is not None:
+            name = name.format(generation)
+
+        return os.path.join(self._path, name)
+
+    @contextmanager
+    def _lock(self):
+        with open(self._file(_LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self._file(_META_FILE), 'r') as file:
+                meta = json.load(file)
+        except (FileNotFoundError, ValueError):
+            meta = None
+
+        if meta is None or meta.get('version') != INDEX_VERSION:
+            return {'version': INDEX_VERSION, 'dimension': None, 'count': 0,
+                    'deleted': 0, 'generation': 0, 'runs': [],
+                    'run_number': 0, 'projection': None}
+
+        return meta
+
+    def _write_meta(self, meta: dict):
+        # Written to a temporary file and moved into place, so readers
+        # never see a count that does not match the data files
+        fd, temp_path = tempfile.mkstemp(dir=self._path)
+        with os.fdopen(fd, 'w') as file:
+            json.dump(meta, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, self._file(_META_FILE))
+
+    def _write_rows(self, path: str, offset: int, rows):
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as file:
+            # Drops anything left behind by an append that never finished
+            file.truncate(offset)
+            file.seek(offset)
+            file.write(rows.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _map(self, meta: dict, mode: str = 'r'):
+        generation = meta['generation']
+
+        features = np.memmap(
+            self._file(_FEATURES_FILE, generation), dtype=np.float32,
+            mode=mode, shape=(meta['count'], meta['dimension']))
+        segments = np.memmap(
+            self._file(_SEGMENTS_FILE, generation), dtype=SEGMENT_DTYPE,
+            mode=mode, shape=(meta['count'],))
+
+        return features, segments
+
+    def _read_run(self, run: list):
+        number, length = run
+        path = self._file(_RUN_FILE, number)
+
+        # The sorted ids are followed by their rows
+        ids = np.memmap(path, dtype='S12', mode='r', shape=(length,))
+        rows = np.memmap(path, dtype='<i8', mode='r', offset=length * 12,
+                         shape=(length,))
+
+        return ids, rows
+
+    def _find_rows(self, meta: dict, ids):
+        # The rows of the given ids in every run, a replaced id is in an
+        # older run with its old row as well
+        found = [np.empty(0, dtype=np.int64)]
+        for run in meta['runs']:
+            run_ids, run_rows = self._read_run(run)
+
+            positions = np.minimum(np.searchsorted(run_ids, ids),
+                                   len(run_ids) - 1)
+            matched = run_ids[positions] == ids
+            found.append(np.asarray(run_rows[positions[matched]]))
+
+        return np.unique(np.concatenate(found))
+
+    def _add_run(self, meta: dict, ids, rows) -> dict:
+        # Merges the new ids with every run that is not longer, which keeps
+        # the number of runs and the cost of each id logarithmic
+        if len(ids) == 0:
+            return meta, []
+
+        runs = list(meta['runs'])
+        merged = []
+        while len(runs) > 0 and runs[-1][1] <= len(ids):
+            run = runs.pop()
+            run_ids, run_rows = self._read_run(run)
+            ids = np.concatenate((np.asarray(run_ids), ids))
+            rows = np.concatenate((np.asarray(run_rows), rows))
+            merged.append(run)
+
+        # Only the latest row of an id is kept, older ones are deleted
+        order = np.lexsort((rows, ids))
+        ids, rows = ids[order], rows[order]
+        latest = np.ones(len(ids), dtype=bool)
+        latest[:-1] = ids[:-1] != ids[1:]
+        ids, rows = ids[latest], rows[latest]
+
+        number = meta['run_number']
+        self._write_rows(self._file(_RUN_FILE, number), 0,
+                         np.frombuffer(ids.tobytes() +
+                                       rows.astype('<i8').tobytes(),
+                                       dtype=np.uint8))
+
+        return dict(meta, runs=runs + [[number, len(ids)]],
+                    run_number=number + 1), merged
+
+    def _remove_runs(self, runs: list):
+        for number, _ in runs:
+            os.remove(self._file(_RUN_FILE, number))
+
+    def refresh(self):
+        """Re-reads the index from disk to pick up rows appended by others"""
+
+        while True:
+            meta = self._read_meta()
+
+            if meta['count'] == 0:
+                features = np.empty(
+                    (0, meta['dimension'] or 0), dtype=np.float32)
+                segments = np.empty(0, dtype=SEGMENT_DTYPE)
+                break
+
+            try:
+                features, segments = self._map(meta)
+                break
+            except FileNotFoundError:
+                # Compacted by another process since the meta was read,
+                # the new meta points to the new generation
+                continue
+
+        self._dimension = meta['dimension']
+        self._count = meta['count']
+        self._projection = meta['projection']
+        self._features = features
+        self._segments = segments
+
+    def append(self, segments: list):
+        """Appends segments to the index, replacing rows with the same id
+
+        Parameters
+        ----------
+        segments : list of Tuple[id: ObjectId, song_id: str, time: int, feature]
+            The segments to add, in the format used by the similarity module
+        """
+
+        if len(segments) == 0:
+            return
+
+        too_long = list(filter(
+            lambda seg: len(seg[1].encode()) > SONG_ID_LENGTH, segments))
+        if len(too_long) > 0:
+            raise ValueError(
+                "Song id '{}' is longer than {} bytes"
+                .format(too_long[0][1], SONG_ID_LENGTH))
+
+        features = np.asarray(
+            list(map(lambda seg: seg[3], segments)), dtype=np.float32)
+        records = np.array(list(map(
+            lambda seg: (seg[0].binary, seg[1].encode(), seg[2], False),
+            segments)), dtype=SEGMENT_DTYPE)
+
+        with self._lock():
+            meta = self._read_meta()
+
+            count = meta['count']
+            deleted = meta['deleted']
+            generation = meta['generation']
+            dimension = meta['dimension'] or features.shape[1]
+
+            if features.shape[1] != dimension:
+                raise ValueError(
+                    "Feature dimension {} does not match the index ({})"
+                    .format(features.shape[1], dimension))
+
+            stale = self._find_rows(meta, records['id'])
+            if len(stale) > 0:
+                _, existing = self._map(meta, 'r+')
+                stale = stale[~existing['deleted'][stale]]
+                existing['deleted'][stale] = True
+                existing.flush()
+                deleted += len(stale)
+                del existing
+
+            self._write_rows(self._file(_FEATURES_FILE, generation),
+                             count * dimension * features.itemsize, features)
+            self._write_rows(self._file(_SEGMENTS_FILE, generation),
+                             count * SEGMENT_DTYPE.itemsize, records)
+
+            meta, merged = self._add_run(
+                meta, records['id'],
+                np.arange(count, count + len(records), dtype=np.int64))
+            meta = dict(meta, dimension=dimension,
+                        count=count + len(records), deleted=deleted)
+            self._write_meta(meta)
+            self._remove_runs(merged)
+
+            if deleted > max(COMPACT_MINIMUM, meta['count'] * COMPACT_RATIO):
+                self._compact(meta)
+
+        self.refresh()
+
+    def _compact(self, meta: dict):
+        generation = meta['generation'] + 1
+        features, segments = self._map(meta)
+
+        live = np.flatnonzero(~segments['deleted'])
+        ids = np.asarray(segments['id'][live])
+
+        features_path = self._file(_FEATURES_FILE, generation)
+        segments_path = self._file(_SEGMENTS_FILE, generation)
+        self._write_rows(features_path, 0, np.empty(0, dtype=np.float32))
+        self._write_rows(segments_path, 0, np.empty(0, dtype=SEGMENT_DTYPE))
+
+        for start in range(0, len(live), _COMPACT_CHUNK):
+            rows = live[start:start + _COMPACT_CHUNK]
+            self._write_rows(features_path, start * features.itemsize *
+                             meta['dimension'], features[rows])
+            self._write_rows(segments_path, start * SEGMENT_DTYPE.itemsize,
+                             segments[rows])
+
+        del features
+        del segments
+
+        compacted, _ = self._add_run(
+            dict(meta, runs=[]), ids, np.arange(len(live), dtype=np.int64))
+        self._write_meta(dict(compacted, count=len(live), deleted=0,
+                              generation=generation))
+        self._remove_runs(meta['runs'])
+
+        # Readers that mapped the old generation keep their mapping, the
+        # files are gone once they refresh
+        os.remove(self._file(_FEATURES_FILE, meta['generation']))
+        os.remove(self._file(_SEGMENTS_FILE, meta['generation']))
+
+    def compact(self):
+        """Drops the deleted rows from the index, which changes the row of
+        every segment after the first deleted one"""
+
+        with self._lock():
+            meta = self._read_meta()
+
+            if meta['deleted'] > 0:
+                self._compact(meta)
+
+        self.refresh()
+
+    def reset(self, projection: str = None):
+        """Removes every row from the index
+
+        Parameters
+        ----------
+        projection : str, optional
+            The key of the projection the features added from now on
+            are projected with, given none they are not projected
+        """
+
+        with self._lock():
+            meta = self._read_meta()
+            self._write_meta(dict(meta, dimension=None, count=0, deleted=0,
+                                  runs=[], projection=projection))
+            self._remove_runs(meta['runs'])
+
+        self.refresh()
+
+    def segment(self, row: int) -> tuple:
+        """Gets a single row as a segment tuple
+
+        Parameters
+        ----------
+        row : int
+            The row in the index
+
+        Returns
+        -------
+        Tuple[id: ObjectId, song_id: str, time: int, feature]
+            The segment in the format used by the similarity module
+        """
+
+        record = self._segments[row]
+
+        return (ObjectId(bytes(record['id']).ljust(12, b'\x00')),
+                record['song_id'].decode(), int(record['time']),
+                np.asarray(self._features[row]))
+
+    def bucket(self, number: int, size: int):
+        """Gets the live rows and features of a bucket of the index
+
+        Parameters
+        ----------
+        number : int
+            The number of the bucket
+        size : int
+            The number of rows in each bucket
+
+        Returns
+        -------
+        Tuple[rows, data]
+            The index rows in the bucket and a contiguous feature matrix
+            with one line per row
+        """
+
+        start = min(number * size, self._count)
+        end = min((number + 1) * size, self._count)
+
+        rows = np.arange(start, end)[~self._segments['deleted'][start:end]]
+
+        return rows, np.ascontiguousarray(self._features[rows])
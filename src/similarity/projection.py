@@ -0,0 +1,231 @@
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+
+
+# The methods a projection can be fitted with
+METHODS = ['pca', 'random']
+
+_PROJECTION_FILE = 'projection.npz'
+
+
+class Projection:
+    """
+    A linear map of feature vectors to a lower dimension, applied before
+    segments are indexed so that building, storing and searching the index
+    all cost less. Distances between projected vectors approximate the
+    distances between the full vectors.
+
+    Methods
+    -------
+    fit(features, dimension, method, memory_budget)
+        Fits a projection on a sample of feature vectors
+
+    random(input_dimension, dimension)
+        Creates a random projection
+
+    transform(features)
+        Projects feature vectors to the lower dimension
+
+    save(path)
+        Stores the projection in the given directory
+
+    load(path)
+        Loads the projection stored in the given directory
+
+    remove(path)
+        Removes the projection stored in the given directory
+    """
+
+    def __init__(self, method: str, mean, components):
+        self.method = method
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+
+    @property
+    def key(self) -> str:
+        """Identifies the projection, the index records it so rows
+        projected differently are never compared"""
+
+        digest = hashlib.sha1()
+        digest.update(self.method.encode())
+        digest.update(self.mean.tobytes())
+        digest.update(self.components.tobytes())
+
+        return digest.hexdigest()[:16]
+
+    @property
+    def dimension(self) -> int:
+        """The dimension features are projected to"""
+
+        return self.components.shape[1]
+
+    @property
+    def input_dimension(self) -> int:
+        """The dimension of the features the projection accepts"""
+
+        return self.components.shape[0]
+
+    @staticmethod
+    def fit(features, dimension: int, method: str = 'pca',
+            memory_budget: int = None):
+        """Fits a projection on a sample of feature vectors
+
+        Parameters
+        ----------
+        features
+            The sample, one feature vector per line
+        dimension : int
+            The dimension to project to
+        method : str, optional
+            Either 'pca' to keep the directions the sample varies the most
+            in, or 'random' for a random Gaussian projection
+        memory_budget : int, optional
+            The number of bytes of the sample copied at once,
+            given none the whole sample is copied at once
+
+        Returns
+        -------
+        Projection
+            The fitted projection
+        """
+
+        if method not in METHODS:
+            raise ValueError("Unknown projection method '{}'".format(method))
+
+        input_dimension = len(features[0])
+        dimension = min(dimension, input_dimension)
+
+        if method == 'random':
+            return Projection.random(input_dimension, dimension)
+
+        chunk = len(features)
+        if memory_budget is not None:
+            chunk = max(1, memory_budget // (input_dimension * 4))
+
+        mean = np.zeros(input_dimension, dtype=np.float64)
+        for start in range(0, len(features), chunk):
+            mean += np.asarray(features[start:start + chunk],
+                               dtype=np.float32).sum(axis=0, dtype=np.float64)
+        mean = (mean / len(features)).astype(np.float32)
+
+        # The directions the sample varies the most in are the eigenvectors
+        # of its covariance matrix with the largest eigenvalues, which is
+        # summed up a chunk of the sample at a time
+        covariance = np.zeros((input_dimension, input_dimension),
+                              dtype=np.float32)
+        for start in range(0, len(features), chunk):
+            centered = np.array(features[start:start + chunk],
+                                dtype=np.float32)
+            centered -= mean
+            covariance += centered.T @ centered
+            del centered
+
+        covariance /= len(features)
+        _, vectors = np.linalg.eigh(covariance)
+
+        # Eigenvalues come in ascending order
+        components = vectors[:, ::-1][:, :dimension]
+
+        return Projection(method, mean, components)
+
+    @staticmethod
+    def random(input_dimension: int, dimension: int):
+        """Creates a random projection, which keeps distances up to a small
+        error by the Johnson-Lindenstrauss lemma
+
+        Parameters
+        ----------
+        input_dimension : int
+            The dimension of the features to project
+        dimension : int
+            The dimension to project to
+
+        Returns
+        -------
+        Projection
+            The random projection
+        """
+
+        dimension = min(dimension, input_dimension)
+
+        rng = np.random.RandomState(5721840)
+        components = rng.normal(
+            0, 1 / np.sqrt(dimension), (input_dimension, dimension))
+
+        return Projection('random', np.zeros(input_dimension), components)
+
+    def transform(self, features):
+        """Projects feature vectors to the lower dimension
+
+        Parameters
+        ----------
+        features
+            A feature vector, or one feature vector per line
+
+        Returns
+        -------
+        ndarray
+            The projected features, as float32
+        """
+
+        features = np.asarray(features, dtype=np.float32)
+
+        return (features - self.mean) @ self.components
+
+    def save(self, path: str):
+        """Stores the projection in the given directory
+
+        Parameters
+        ----------
+        path : str
+            The directory to store the projection in
+        """
+
+        # Written to a temporary file and moved into place, so other
+        # processes never load a partly written projection
+        fd, temp_path = tempfile.mkstemp(dir=path, suffix='.npz')
+        with os.fdopen(fd, 'wb') as file:
+            np.savez(file, method=self.method, mean=self.mean,
+                     components=self.components)
+
+        os.replace(temp_path, os.path.join(path, _PROJECTION_FILE))
+
+    @staticmethod
+    def load(path: str):
+        """Loads the projection stored in the given directory
+
+        Parameters
+        ----------
+        path : str
+            The directory the projection is stored in
+
+        Returns
+        -------
+        Projection
+            The projection, or None if none is stored
+        """
+
+        try:
+            with np.load(os.path.join(path, _PROJECTION_FILE)) as data:
+                return Projection(str(data['method']), data['mean'],
+                                  data['components'])
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def remove(path: str):
+        """Removes the projection stored in the given directory
+
+        Parameters
+        ----------
+        path : str
+            The directory the projection is stored in
+        """
+
+        try:
+            os.remove(os.path.join(path, _PROJECTION_FILE))
+        except FileNotFoundError:
+            pass
@@ -8,8 +8,14 @@ import librosa
 import numpy as np
 import falconn
 from scipy.spatial import distance
-
-from database.mongo.audio.song_segment import SongSegment
+from bson.objectid import ObjectId
+
+from database.mongo.audio.song_segment import SongSegment, decode_array, \
+    LEGACY_FEATURE_FIELDS
+from database.mongo.audio.similar_segments import SimilarSegments
+from similarity.index import SimilarityIndex
+from similarity.exact import exact_matches
+from similarity.projection import Projection
 from utilities.config_loader import load_config
 from utilities.filehandler.handle_path import get_absolute_path
 from utilities.get_song_id import get_song_id
@@ -18,6 +24,28 @@ from utilities.get_song_id import get_song_id
 cfg = load_config()
 MATCHES = cfg['similarity_matches']
 BUCKET_SIZE = cfg['similarity_bucket_size']
+INDEX_PATH = cfg['similarity_index_path']
+MEMORY_BUDGET = cfg['similarity_memory_budget'] * 1024 * 1024
+WRITE_BATCH_SIZE = cfg['similarity_write_batch_size']
+
+# Either 'lsh' to search buckets with falconn, or 'exact' to compare
+# every segment with the whole index
+ENGINE = cfg['similarity_engine']
+
+# Either 'none', or 'pca' or 'random' to project features to a lower
+# dimension before they are indexed, fitted on a sample of the segments
+PROJECTION = cfg['similarity_projection']
+PROJECTION_DIMENSION = cfg['similarity_projection_dimension']
+PROJECTION_SAMPLE = cfg['similarity_projection_sample']
+
+# The fields describing where a segment is
+TIME_FIELDS = ['song_id', 'time_from', 'time_to']
+
+# The fields needed to turn a db segment into a feature vector
+FEATURE_FIELDS = ['song_id', 'time_from', 'feature'] + LEGACY_FEATURE_FIELDS
+
+# The sample rate features are computed at
+SAMPLE_RATE = 22050
 
 
 def _flatten(l):
@@ -76,10 +104,24 @@ def _load_songs(songs):
     return segs
 
 
-def _load_song(song_id, filename, segments, force=False):
+def _resample_song(audio, sample_rate):
+    """ Downmixes decoded stereo audio to mono
+    at the sample rate features are computed at
+    """
+
+    y = np.mean(audio, axis=1)
+
+    if sample_rate != SAMPLE_RATE:
+        y = librosa.resample(y, sample_rate, SAMPLE_RATE)
+
+    return y, SAMPLE_RATE
+
+
+def _load_song(song_id, filename, segments, force=False, load_audio=None):
     """ Loads song features from the database if
     available otherwise loading the file and
-    loading features from it directly
+    loading features from it directly, or from
+    the decoded audio load_audio returns
     """
 
     print('Loading: ' + song_id)
@@ -93,7 +135,10 @@ def _load_song(song_id, filename, segments, force=False):
     if (segs == [] or force):
         print('Loading audio file')
         # No segments in db, which means no features in db
-        y, sr = librosa.load(filename)
+        if load_audio is None:
+            y, sr = librosa.load(filename, sr=SAMPLE_RATE)
+        else:
+            y, sr = _resample_song(*load_audio())
 
         for i in range(0, y.shape[0]//sr//5 - 1):
 
@@ -102,39 +147,229 @@ def _load_song(song_id, filename, segments, force=False):
 
             mfcc, chromagram, tempogram = _process_segment(sample, sr)
 
-            _id = segments.add(song_id, i*5*1000, (i+1)*5*1000, mfcc.tobytes(),
-                               chromagram.tobytes(), tempogram.tobytes(), [])
+            feature = _create_feature(
+                mfcc, chromagram, tempogram).astype(np.float32)
 
-            feature = _create_feature(mfcc, chromagram, tempogram)
+            _id = segments.add(song_id, i*5*1000, (i+1)*5*1000, feature, [])
 
             segment_data.append((_id, song_id, i*5, feature))
 
+        _add_to_index(segment_data)
+
     else:
         print('Loaded from database')
         # There are segments in db, look for features
         for i in range(0, len(segs)):
-            segment = segs[i]
+            feature = _segment_feature(segs[i])
 
-            if (segment['mfcc'] is None or
-                segment['chroma'] is None or
-                    segment['tempogram'] is None):
+            if feature is None:
                 break
 
-            feature = _create_feature(np.frombuffer(segment['mfcc']),
-                                      np.frombuffer(segment['chroma']),
-                                      np.frombuffer(segment['tempogram']))
-
-            segment_data.append((segment['_id'], song_id, i*5, feature))
+            segment_data.append((segs[i]['_id'], song_id, i*5, feature))
 
     return segment_data
 
 
+def _add_to_index(segment_data):
+    """ Adds newly stored segments
+    to the similarity index
+    """
+
+    # The index is only extended once it has been built, the first
+    # similarity run picks these segments up from the database instead
+    path = get_absolute_path(INDEX_PATH)
+    index = SimilarityIndex(path)
+    if len(index) == 0:
+        return
+
+    projection = None
+    if index.projection is not None:
+        projection = Projection.load(path)
+
+    # A projection that was just replaced means the index is about to be
+    # rebuilt, which picks these segments up as well
+    if index.projection == _projection_key(projection):
+        index.append(_project(projection, segment_data))
+
+
+def copy_song_features(from_song_id, to_song_id, segments):
+    """Copies the segment features of a song to
+    another song with the same audio, so that
+    they do not have to be computed again
+
+    Parameters
+    ----------
+    from_song_id : string
+        Id of the song to copy the features from
+    to_song_id : string
+        Id of the song to copy the features to
+    segments : SongSegment
+        The song segment database connection
+
+    Returns
+    -------
+    bool
+        Whether any features were copied
+    """
+
+    segment_data = []
+    for segment in segments.get_all_by_song_id(from_song_id):
+        feature = _segment_feature(segment)
+
+        if feature is None:
+            break
+
+        _id = segments.add(to_song_id, segment['time_from'],
+                           segment['time_to'], feature, [])
+
+        segment_data.append(
+            (_id, to_song_id, segment['time_from'] // 1000, feature))
+
+    _add_to_index(segment_data)
+
+    return len(segment_data) > 0
+
+
+def _segment_feature(segment):
+    """ Gets the feature vector of a db
+    segment, or None if it has not been
+    computed yet
+    """
+
+    if segment.get('feature') is not None:
+        return decode_array(segment['feature'])
+
+    # Segments stored before the combined feature vector
+    # are built from their individual features instead
+    if all(map(lambda field: segment.get(field) is not None,
+               LEGACY_FEATURE_FIELDS)):
+        return _create_feature(
+            np.frombuffer(segment['mfcc']),
+            np.frombuffer(segment['chroma']),
+            np.frombuffer(segment['tempogram'])).astype(np.float32)
+
+    return None
+
+
+def _projection_key(projection):
+    """ The key the index records for a
+    projection, None when not projecting
+    """
+
+    return None if projection is None else projection.key
+
+
+def _project(projection, segs):
+    """ Projects the features of segments
+    to the dimension of the index
+    """
+
+    if projection is None or len(segs) == 0:
+        return segs
+
+    features = projection.transform(
+        np.array(list(map(lambda seg: seg[3], segs))))
+
+    return list(map(lambda seg, feature: (seg[0], seg[1], seg[2], feature),
+                    segs, features))
+
+
+def _feature_dimension(segments):
+    """ The length of the feature vectors,
+    from the first segment that has one
+    """
+
+    for batch in segments.get_batches(100, FEATURE_FIELDS):
+        for segment in batch:
+            feature = _segment_feature(segment)
+
+            if feature is not None:
+                return len(feature)
+
+    return None
+
+
+def _fit_projection(segments, path):
+    """ Gets the configured projection, fitting
+    it on a random sample of the segments if
+    it has not been fitted yet
+    """
+
+    projection = Projection.load(path)
+
+    if PROJECTION == 'none':
+        Projection.remove(path)
+        return None
+
+    if (projection is not None and projection.method == PROJECTION and
+            projection.dimension == min(PROJECTION_DIMENSION,
+                                        projection.input_dimension)):
+        return projection
+
+    if PROJECTION == 'random':
+        # Only the dimension of the features is needed
+        dimension = _feature_dimension(segments)
+
+        if dimension is None:
+            return None
+
+        projection = Projection.random(dimension, PROJECTION_DIMENSION)
+    else:
+        sample = list(filter(
+            lambda feature: feature is not None,
+            map(_segment_feature,
+                segments.get_sample(PROJECTION_SAMPLE, FEATURE_FIELDS))))
+
+        if len(sample) == 0:
+            return None
+
+        print("Fitting " + PROJECTION + " projection to " +
+              str(PROJECTION_DIMENSION) + " dimensions on " +
+              str(len(sample)) + " segments")
+
+        projection = Projection.fit(sample, PROJECTION_DIMENSION, PROJECTION,
+                                    MEMORY_BUDGET)
+
+    projection.save(path)
+
+    return projection
+
+
+def _open_index(segments):
+    """ Opens the similarity index and its
+    projection, building the index from the
+    database if it is empty or was built
+    with another projection
+    """
+
+    path = get_absolute_path(INDEX_PATH)
+    index = SimilarityIndex(path)
+    projection = _fit_projection(segments, path)
+
+    if index.projection != _projection_key(projection):
+        index.reset(_projection_key(projection))
+
+    if len(index) == 0:
+        print("Building similarity index from " +
+              str(segments.count()) + " segments")
+
+        for batch in segments.get_batches(BUCKET_SIZE, FEATURE_FIELDS):
+            index.append(_project(projection, list(filter(
+                lambda seg: seg is not None,
+                map(_process_db_segment, batch)))))
+
+    return index, projection
+
+
 def _process_db_segment(segment):
     """ Processes a db segment to the format
-    used by the module
+    used by the module, or None if its
+    features have not been computed
     """
-    feature = _create_feature(np.frombuffer(segment['mfcc']), np.frombuffer(
-        segment['chroma']), np.frombuffer(segment['tempogram']))
+    feature = _segment_feature(segment)
+
+    if feature is None:
+        return None
 
     return (segment['_id'], segment['song_id'],
             segment['time_from'] // 1000, feature)
@@ -190,28 +425,157 @@ def _dist(seg1, seg2):
     return distance.euclidean(seg1[3], seg2[3])
 
 
-def _find_best_matches(matches, segment):
-    """ Finds the best n matches
-    out of all matches, where n is
-    the MATCHES variable
+def _rank_matches(index, segs, candidates):
+    """ Finds the best n matches for every
+    segment out of its candidates, where n
+    is the MATCHES variable
     """
 
-    lows = []
-    for i in range(0, len(matches)):
-        distance = _dist(
-            segment, matches[i])
+    width = max(map(len, candidates), default=0)
+    if width == 0:
+        return list(map(lambda x: [], segs))
+
+    # The candidates of a chunk of segments are stacked into one matrix so
+    # their distances are computed at once, -1 marks padding
+    padded = np.full((len(segs), width), -1, dtype=np.int64)
+    for i, rows in enumerate(candidates):
+        padded[i, :len(rows)] = rows
+
+    queries = np.array(list(map(lambda seg: seg[3], segs)), dtype=np.float32)
+    song_ids = np.array(list(map(lambda seg: seg[1].encode(), segs)))
+
+    # Chunks are sized to stay within the memory budget
+    chunk = max(1, MEMORY_BUDGET // (2 * width * index.dimension * 4))
+    count = min(MATCHES, width)
+
+    best = []
+    for start in range(0, len(segs), chunk):
+        rows = padded[start:start + chunk]
+        valid = rows >= 0
+        safe = np.where(valid, rows, 0)
+
+        diff = index.features[safe.ravel()].reshape(
+            rows.shape + (index.dimension,))
+        diff -= queries[start:start + chunk, np.newaxis, :]
+        dists = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+        del diff
+
+        # Matches from the song the segment originates from are invalid
+        same_song = (index.segments['song_id'][safe] ==
+                     song_ids[start:start + chunk, np.newaxis])
+        dists[~valid | same_song] = np.inf
+
+        lowest = np.argpartition(dists, count - 1, axis=1)[:, :count]
+        lowest_dists = np.take_along_axis(dists, lowest, axis=1)
+        order = np.argsort(lowest_dists, axis=1)
+        lowest = np.take_along_axis(lowest, order, axis=1)
+        lowest_dists = np.take_along_axis(lowest_dists, order, axis=1)
+
+        for i in range(0, len(rows)):
+            found = np.isfinite(lowest_dists[i])
+            best.append(list(zip(rows[i][lowest[i][found]].tolist(),
+                                 lowest_dists[i][found].tolist())))
+
+    return best
+
+
+def _object_id(id):
+    """ Creates an object id from its bytes
+    as stored in a numpy array, which drops
+    trailing null bytes
+    """
+
+    return ObjectId(bytes(id).ljust(12, b'\x00'))
+
+
+def _merge_neighbours(targets, ids, distances, limit: int):
+    """ Dedupes and truncates neighbour lists
+    given as parallel arrays of list, segment
+    and distance, ordered by list and distance
+    """
+
+    # The first entry of every (list, segment) pair is its closest
+    order = np.lexsort((distances, ids, targets))
+    targets, ids, distances = targets[order], ids[order], distances[order]
+
+    first = np.ones(len(targets), dtype=bool)
+    first[1:] = (targets[1:] != targets[:-1]) | (ids[1:] != ids[:-1])
+    targets, ids, distances = targets[first], ids[first], distances[first]
+
+    order = np.lexsort((distances, targets))
+    targets, ids, distances = targets[order], ids[order], distances[order]
 
-        if segment[1] != matches[i][1]:
-            if len(lows) < MATCHES:
-                lows.append((i, distance))
-            else:
-                for j in range(0, MATCHES):
-                    if lows[j][1] > distance:
-                        lows.insert(j, (i, distance))
-                        lows.pop()
-                        break
+    # The position of every entry within its list
+    starts = np.flatnonzero(np.r_[True, targets[1:] != targets[:-1]])
+    position = np.arange(len(targets)) - np.repeat(
+        starts, np.diff(np.r_[starts, len(targets)]))
 
-    return list(map(lambda i: (matches[i[0]], i[1]), lows))
+    keep = position < limit
+
+    return targets[keep], ids[keep], distances[keep]
+
+
+def _merge_similar(ss, index, segs, ranked):
+    """ Merges the matches into the similar
+    lists of both sides and writes them in
+    bulk, returns the updated segment ids
+    """
+
+    query_ids = np.array(list(map(lambda seg: seg[0].binary, segs)),
+                         dtype='S12')
+
+    matches = _flatten(ranked)
+    counts = np.array(list(map(len, ranked)), dtype=np.int64)
+    rows = np.array(list(map(lambda match: match[0], matches)),
+                    dtype=np.int64)
+    dists = np.array(list(map(lambda match: match[1], matches)),
+                     dtype=np.float64)
+
+    sources = np.repeat(query_ids, counts)
+    matched = index.segments['id'][rows].astype('S12')
+
+    # Every match is added to both the segment and the segment it matched,
+    # the similar list of a segment is replaced by its matches
+    targets = [sources, matched]
+    ids = [matched, sources]
+    distances = [dists, dists]
+
+    # Matched segments that were not searched for keep their existing
+    # similar segments, which are fetched in batches
+    existing = np.setdiff1d(np.unique(matched), query_ids)
+    for start in range(0, len(existing), WRITE_BATCH_SIZE):
+        batch = list(map(_object_id,
+                         existing[start:start + WRITE_BATCH_SIZE]))
+
+        for segment in ss.get_by_ids(batch, ['similar']):
+            similar = segment.get('similar') or []
+            targets.append(np.full(len(similar), segment['_id'].binary,
+                                   dtype='S12'))
+            ids.append(np.array(list(map(lambda sim: sim['id'].binary,
+                                         similar)), dtype='S12'))
+            distances.append(np.array(list(map(
+                lambda sim: sim['distance'], similar)), dtype=np.float64))
+
+    targets, ids, distances = _merge_neighbours(
+        np.concatenate(targets), np.concatenate(ids),
+        np.concatenate(distances), MATCHES)
+
+    # Segments without any matches are updated to an empty list
+    updated = np.union1d(query_ids, targets)
+    ends = np.searchsorted(targets, updated, side='right')
+    starts = np.searchsorted(targets, updated, side='left')
+
+    similar = []
+    for target, start, end in zip(updated, starts, ends):
+        similar.append((_object_id(target), list(map(
+            lambda j: dict({
+                'id': _object_id(ids[j]),
+                'distance': float(distances[j]),
+            }), range(start, end)))))
+
+    ss.update_similar_many(similar, WRITE_BATCH_SIZE)
+
+    return list(map(lambda s: s[0], similar))
 
 
 def query_similar(song_id, from_time, to_time):
@@ -230,43 +594,163 @@ def query_similar(song_id, from_time, to_time):
     Returns
     -------
     list of Dict[song_id : string, from_time: time_from, to_time: time_to]
-        A list of all the segments which are similar
+        A list of all the segments which are similar, or None if
+        none have been found
     """
 
-    seg_db = SongSegment()
-    segments = seg_db.get_all_by_song_id(song_id)
+    # Read from the precomputed results of the segment at from_time
+    results_db = SimilarSegments()
+    segments = results_db.get_overlapping(song_id, from_time, from_time + 1)
+    results_db.close()
 
-    best = (None, None)
-    for segment in segments:
-        localdist = abs(from_time - segment['time_from'])
-        if best is None or localdist < best[0]:
-            best = (localdist, segment)
+    if len(segments) > 0:
+        similar = segments[0]['similar']
+    else:
+        # Segments that have not been published yet are looked up
+        seg_db = SongSegment()
+        segment = seg_db.get_covering(song_id, from_time, ['similar'])
+
+        similar = None
+        if segment is not None and segment.get('similar') is not None:
+            similar = _embed_similar(seg_db, segment['similar'])
+
+        seg_db.close()
 
-    if best is None or 'similar' not in best[1]:
+    if not similar:
         return None
 
-    segment = best[1]
+    return similar
+
+
+def query_similar_range(song_id, from_time, to_time):
+    """Queries the database for the segments similar
+    to every segment overlapping the time range
 
-    similar = segment['similar']
+    Parameters
+    ----------
+    song_id : string
+        Id of the given song
+    from_time : int
+        The start of the time range
+    to_time : int
+        The end of the time range
+
+    Returns
+    -------
+    list of Dict[from_time: int, to_time: int, similar: list]
+        The overlapping segments ordered by time, each with its similar
+        segments in the format query_similar returns them, or None if
+        no segments overlap the time range
+    """
+
+    to_time = max(to_time, from_time + 1)
 
-    similar_ids = list(map(lambda sim: sim['id'], similar))
+    results_db = SimilarSegments()
+    segments = results_db.get_overlapping(song_id, from_time, to_time)
+    results_db.close()
 
-    similar_full = seg_db.get_by_ids(similar_ids)
+    if len(segments) == 0:
+        # Segments that have not been published yet are looked up
+        seg_db = SongSegment()
+        segments = seg_db.get_overlapping(song_id, from_time, to_time,
+                                          ['similar'])
 
-    similar_segments = []
-    for i in range(0, len(similar)):
-        sim_seg = next(
-            seg for seg in similar_full if seg['_id'] == similar[i]['id'])
-        similar_segments.append(dict({
-            'song_id': sim_seg['song_id'],
-            'from_time': sim_seg['time_from'],
-            'to_time': sim_seg['time_to'],
-            'distance': similar[i]['distance'],
+        similar_ids = list(set(
+            sim['id'] for seg in segments for sim in seg.get('similar') or []))
+        similar_segments = dict(map(
+            lambda seg: (seg['_id'], seg),
+            seg_db.get_by_ids(similar_ids, TIME_FIELDS)))
+
+        for segment in segments:
+            segment['similar'] = _embed_similar(
+                seg_db, segment.get('similar'), similar_segments)
+
+        seg_db.close()
+
+    if len(segments) == 0:
+        return None
+
+    return list(map(lambda segment: dict({
+        'from_time': segment['time_from'],
+        'to_time': segment['time_to'],
+        'similar': segment['similar'],
+    }), segments))
+
+
+def _embed_similar(seg_db, similar: list, segments: dict = None) -> list:
+    """ Embeds the song and time range of
+    each similar segment that still exists,
+    looking them up unless segments is given
+    """
+
+    if similar is None:
+        return []
+
+    if segments is None:
+        segments = dict(map(
+            lambda seg: (seg['_id'], seg),
+            seg_db.get_by_ids(list(map(lambda sim: sim['id'], similar)),
+                              TIME_FIELDS)))
+
+    embedded = []
+    for sim in similar:
+        segment = segments.get(sim['id'])
+        if segment is None:
+            continue
+
+        embedded.append(dict({
+            'song_id': segment['song_id'],
+            'from_time': segment['time_from'],
+            'to_time': segment['time_to'],
+            'distance': sim['distance'],
         }))
 
-    seg_db.close()
+    return embedded
 
-    return similar_segments
+
+def _publish_similar(seg_db, segment_ids: list):
+    """ Writes the embedded similar segments
+    of the given segments to the
+    similarity_results collection
+    """
+
+    results_db = SimilarSegments()
+
+    for start in range(0, len(segment_ids), BUCKET_SIZE):
+        segments = seg_db.get_by_ids(
+            segment_ids[start:start + BUCKET_SIZE], TIME_FIELDS + ['similar'])
+
+        similar_ids = list(set(
+            sim['id'] for seg in segments for sim in seg.get('similar') or []))
+        similar_segments = dict(map(
+            lambda seg: (seg['_id'], seg),
+            seg_db.get_by_ids(similar_ids, TIME_FIELDS)))
+
+        results_db.add_many(list(map(lambda seg: (
+            seg['_id'], seg['song_id'], seg['time_from'], seg['time_to'],
+            _embed_similar(seg_db, seg.get('similar'), similar_segments)),
+            segments)))
+
+    results_db.close()
+
+
+def publish_all_similar():
+    """Writes the similar segments of every segment to the
+    similarity_results collection, for segments analyzed
+    before the collection existed
+    """
+
+    s = SongSegment()
+
+    published = 0
+    for batch in s.get_batches(BUCKET_SIZE, ['_id'],
+                               {'similar': {'$ne': None}}):
+        _publish_similar(s, list(map(lambda seg: seg['_id'], batch)))
+
+        published += len(batch)
+        print("Published " + str(published) + " segments")
+
+    s.close()
 
 
 def _find_matches(searchContext):
@@ -316,10 +800,14 @@ def analyze_songs(songs):
     analyze_segments(segs)
 
 
-def analyze_segments(segs):
-    ss = SongSegment()
+def _lsh_matches(index, segs):
+    """ Finds the best n matches for every
+    segment by searching every bucket of the
+    index with LSH and re-ranking the
+    candidates found in all of them
+    """
 
-    count = ss.count()
+    count = len(index)
 
     allMatches = list(map(lambda x: [], segs))
 
@@ -328,16 +816,10 @@ def analyze_segments(segs):
           " buckets, with " + str(BUCKET_SIZE) + " segments in each")
     for i in range(0, count // BUCKET_SIZE + 1):
         print("Bucket: " + str(i + 1))
-        established_segments = list(filter(
-            lambda x:
-            x['mfcc'] is not None and
-            x['chroma'] is not None and
-            x['tempogram'] is not None,
-            ss.get_all_in_range(i*BUCKET_SIZE, (i+1)*BUCKET_SIZE)))
-        established_segments = list(
-            map(_process_db_segment, established_segments))
+        rows, data = index.bucket(i, BUCKET_SIZE)
 
-        data = np.array(list(map(lambda x: x[3], established_segments)))
+        if len(rows) == 0:
+            continue
 
         bucket = _create_bucket(data)
 
@@ -345,52 +827,48 @@ def analyze_segments(segs):
         query_object.set_num_probes(25)
 
         matched = []
-        for i, seg in enumerate(segs):
-            matched.append(matchers[i % len(matchers)
+        for j, seg in enumerate(segs):
+            matched.append(matchers[j % len(matchers)
                                     ].match(seg, query_object))
 
         matches = pykka.get_all(matched)
 
         for j in range(0, len(matches)):
-            allMatches[j].append(
-                list(map(lambda x: established_segments[x], matches[j])))
+            allMatches[j].append(rows[np.array(matches[j], dtype=np.int64)])
 
         del data
         del bucket
-        del established_segments
         del query_object
         del matches
 
     for matcher in matchers:
         matcher.stop()
 
-    for i in range(0, len(segs)):
-        best = _find_best_matches(_flatten(allMatches[i]), segs[i])
+    candidates = list(map(
+        lambda m: np.concatenate(m) if m else np.empty(0, dtype=np.int64),
+        allMatches))
+    return _rank_matches(index, segs, candidates)
 
-        matches = ss.get_by_ids(list(map(lambda match: match[0][0], best)))
-        matches = list(
-            map(lambda match: (match['_id'], match['similar']), matches))
 
-        for j in range(0, len(matches)):
-            matches[j][1].append(dict({
-                'id': segs[i][0],
-                'distance': best[j][1],
-            }))
-
-            match_ids = list(set(map(lambda x: x['id'], matches[j][1])))
-            innerMatches = list(map(lambda match_id: next(
-                x for x in matches[j][1] if x['id'] == match_id), match_ids))
-            innerMatches.sort(key=lambda m: m['distance'])
-            ss.update_similar(matches[j][0], innerMatches[:10])
-
-        formatted = []
-        for match in best:
-            formatted.append(dict({
-                'id': match[0][0],
-                'distance': match[1]
-            }))
-
-        ss.update_similar(segs[i][0], formatted)
+def analyze_segments(segs):
+    ss = SongSegment()
+
+    index, projection = _open_index(ss)
+
+    # The index is stored as float32, the queries need to match it
+    segs = list(map(lambda seg: (seg[0], seg[1], seg[2],
+                                 np.asarray(seg[3], dtype=np.float32)),
+                    _project(projection, segs)))
+
+    if ENGINE == 'exact':
+        ranked = exact_matches(index, segs, MATCHES, MEMORY_BUDGET,
+                               cpu_count())
+    else:
+        ranked = _lsh_matches(index, segs)
+
+    updated = _merge_similar(ss, index, segs, ranked)
+
+    _publish_similar(ss, list(updated))
 
     ss.close()
 
@@ -400,15 +878,13 @@ def analyze_missing_similar():
 
     segment_data = []
 
-    for segment in s._db._db[s._dbcol].find({'similar.' + str(MATCHES - 1): {'$exists': False}}).limit(1000000):
-        if segment['mfcc'] == None or segment['chroma'] == None or segment['tempogram'] == None:
+    for segment in s._db._db[s._dbcol].find({'similar.' + str(MATCHES - 1): {'$exists': False}}, FEATURE_FIELDS).limit(1000000):
+        seg = _process_db_segment(segment)
+
+        if seg is None:
             break
 
-        feature = _create_feature(np.frombuffer(segment['mfcc']), np.frombuffer(
-            segment['chroma']), np.frombuffer(segment['tempogram']))
-
-        segment_data.append(
-            (segment['_id'], segment['song_id'], segment['time_from'], feature))
+        segment_data.append(seg)
 
     s.close()
 
@@ -419,3 +895,30 @@ def analyze_missing_similar():
     else:
         # This seems like the wrong place for this, but good enough for now
         time.sleep(60*10)
+
+
+def migrate_segment_features():
+    """Converts segments stored with individual mfcc,
+    chroma and tempogram features to the combined
+    float32 feature vector
+    """
+
+    s = SongSegment()
+
+    legacy = {'feature': {'$exists': False},
+              LEGACY_FEATURE_FIELDS[0]: {'$ne': None}}
+
+    migrated = 0
+    for batch in s.get_batches(BUCKET_SIZE, FEATURE_FIELDS, legacy):
+        features = []
+        for segment in batch:
+            feature = _segment_feature(segment)
+            if feature is not None:
+                features.append((segment['_id'], feature))
+
+        s.update_features(features)
+
+        migrated += len(features)
+        print("Migrated " + str(migrated) + " segments")
+
+    s.close()
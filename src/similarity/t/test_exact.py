@@ -0,0 +1,57 @@
+import numpy as np
+from bson.objectid import ObjectId
+
+from similarity.index import SimilarityIndex
+from similarity.exact import exact_matches
+
+
+def _brute_force(features, song_ids, query, song_id, count):
+    dists = np.sqrt(((features - query) ** 2).sum(axis=1))
+    dists[song_ids == song_id] = np.inf
+    order = np.argsort(dists, kind='stable')[:count]
+    return list(filter(lambda row: np.isfinite(dists[row]), order.tolist()))
+
+
+def test_exact_matches(tmp_path):
+    rng = np.random.RandomState(0)
+    features = rng.rand(200, 8).astype(np.float32)
+    song_ids = np.array(list(map(lambda i: str(i // 4), range(200))))
+
+    index = SimilarityIndex(str(tmp_path))
+    index.append(list(map(
+        lambda i: (ObjectId(), song_ids[i], 0, features[i]), range(200))))
+
+    segs = list(map(lambda i: (ObjectId(), song_ids[i], 0, features[i]),
+                    range(0, 200, 7)))
+
+    # A small budget splits the search into many tiles and chunks
+    best = exact_matches(index, segs, 5, 8 * 1024, 3)
+
+    for seg, matches in zip(segs, best):
+        expected = _brute_force(features, song_ids, seg[3], seg[1], 5)
+
+        assert list(map(lambda m: m[0], matches)) == expected
+        assert all(map(lambda m: song_ids[m[0]] != seg[1], matches))
+        assert np.allclose(
+            list(map(lambda m: m[1], matches)),
+            np.sqrt(((features[expected] - seg[3]) ** 2).sum(axis=1)),
+            atol=1e-5)
+
+
+def test_deleted_rows_are_not_matched(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    replaced = ObjectId()
+    index.append([(replaced, 'a', 0, np.array([0, 0])),
+                  (ObjectId(), 'b', 0, np.array([5, 0]))])
+    index.append([(replaced, 'a', 0, np.array([9, 0]))])
+
+    best = exact_matches(index, [(ObjectId(), 'c', 0, np.array([0, 0]))],
+                         5, 1024 * 1024, 1)
+
+    assert list(map(lambda m: m[0], best[0])) == [1, 2]
+
+
+def test_without_segments(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+
+    assert exact_matches(index, [], 5, 1024, 1) == []
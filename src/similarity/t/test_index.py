@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+
+from similarity.index import SimilarityIndex
+
+
+def _segments(count, song_id='1-1-1', dimension=4):
+    return [(ObjectId(), song_id, i * 5, np.full(dimension, i))
+            for i in range(count)]
+
+
+def test_append_and_reopen(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    assert len(index) == 0
+
+    segments = _segments(3)
+    index.append(segments)
+
+    reopened = SimilarityIndex(str(tmp_path))
+    assert len(reopened) == 3
+    assert reopened.dimension == 4
+
+    _id, song_id, time, feature = reopened.segment(2)
+    assert _id == segments[2][0]
+    assert song_id == '1-1-1'
+    assert time == 10
+    assert feature.dtype == np.float32
+    assert np.array_equal(feature, segments[2][3])
+
+
+def test_append_extends_index(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    index.append(_segments(3))
+    index.append(_segments(2, '2-2-2'))
+
+    assert len(index) == 5
+    assert index.segment(4)[1] == '2-2-2'
+
+
+def test_append_replaces_existing_ids(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    segments = _segments(3)
+    index.append(segments)
+    index.append([(segments[0][0], '1-1-1', 0, np.full(4, 7))])
+
+    rows, data = index.bucket(0, 10)
+
+    assert list(rows) == [1, 2, 3]
+    assert np.array_equal(data[-1], np.full(4, 7))
+
+
+def test_append_replaces_ids_of_earlier_appends(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    segments = _segments(7)
+    for segment in segments:
+        index.append([segment])
+
+    index.append([segments[1], segments[5]])
+    index.append([segments[1]])
+
+    rows, _ = index.bucket(0, 20)
+
+    assert list(rows) == [0, 2, 3, 4, 6, 8, 9]
+    assert index.segment(9)[0] == segments[1][0]
+
+
+def test_song_id_too_long(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        index.append(_segments(1, song_id='1' * 33))
+
+    assert len(index) == 0
+
+
+def test_bucket(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    index.append(_segments(5))
+
+    rows, data = index.bucket(1, 2)
+    assert list(rows) == [2, 3]
+    assert data.shape == (2, 4)
+
+    rows, data = index.bucket(3, 2)
+    assert len(rows) == 0
+
+
+def test_wrong_dimension(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    index.append(_segments(1))
+
+    with pytest.raises(ValueError):
+        index.append(_segments(1, dimension=5))
+
+
+def test_reset(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    index.append(_segments(2))
+    index.reset()
+
+    assert len(index) == 0
+
+
+def test_reset_records_projection(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    assert index.projection is None
+
+    index.reset('abc')
+    index.append(_segments(2))
+
+    reopened = SimilarityIndex(str(tmp_path))
+    assert reopened.projection == 'abc'
+    assert len(reopened) == 2
+
+
+def test_compacts_deleted_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr('similarity.index.COMPACT_MINIMUM', 0)
+
+    index = SimilarityIndex(str(tmp_path))
+    segments = _segments(4)
+    index.append(segments)
+
+    # Replacing three of the four rows leaves three of seven deleted
+    index.append(list(map(lambda seg: (seg[0], '2-2-2', seg[2], seg[3] + 1),
+                          segments[:3])))
+
+    reopened = SimilarityIndex(str(tmp_path))
+    assert len(reopened) == 4
+    assert not reopened.segments['deleted'].any()
+    assert reopened.segment(0)[0] == segments[3][0]
+    assert reopened.segment(1)[1] == '2-2-2'
+    assert np.array_equal(reopened.segment(1)[3], segments[0][3] + 1)
+    assert len(list(tmp_path.glob('features.*'))) == 1
+
+
+def test_compact_keeps_old_mapping(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    segments = _segments(3)
+    index.append(segments)
+
+    other = SimilarityIndex(str(tmp_path))
+    other.append(segments[:1])
+    other.compact()
+
+    # Mapped before the compaction, so the rows are unchanged until refresh
+    assert len(index) == 3
+    assert index.segment(0)[0] == segments[0][0]
+
+    index.refresh()
+    assert len(index) == 3
+    assert index.segment(2)[0] == segments[0][0]
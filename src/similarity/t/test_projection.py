@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from similarity.projection import Projection
+
+
+def _low_rank_features(count=200, dimension=50, rank=5):
+    rng = np.random.RandomState(0)
+    return (rng.rand(count, rank) @ rng.rand(rank, dimension)).astype(
+        np.float32)
+
+
+def _distances(features):
+    diff = features[:, np.newaxis, :] - features[np.newaxis, :, :]
+    return np.sqrt((diff ** 2).sum(axis=2))
+
+
+def test_pca_keeps_distances():
+    features = _low_rank_features()
+    projection = Projection.fit(features, 5, 'pca')
+
+    projected = projection.transform(features)
+
+    assert projected.shape == (200, 5)
+    assert projected.dtype == np.float32
+    assert np.allclose(_distances(projected), _distances(features),
+                       atol=1e-3)
+
+
+def test_random_approximates_distances():
+    features = _low_rank_features()
+    projection = Projection.fit(features, 40, 'random')
+
+    projected = projection.transform(features)
+    ratio = (_distances(projected)[np.triu_indices(200, 1)] /
+             _distances(features)[np.triu_indices(200, 1)])
+
+    assert projected.shape == (200, 40)
+    assert abs(np.median(ratio) - 1) < 0.2
+
+
+def test_transform_single_feature():
+    features = _low_rank_features()
+    projection = Projection.fit(features, 5, 'pca')
+
+    assert np.allclose(projection.transform(features[3]),
+                       projection.transform(features)[3])
+
+
+def test_save_and_load(tmp_path):
+    projection = Projection.fit(_low_rank_features(), 5, 'pca')
+    projection.save(str(tmp_path))
+
+    loaded = Projection.load(str(tmp_path))
+
+    assert loaded.method == 'pca'
+    assert loaded.key == projection.key
+    assert np.array_equal(loaded.components, projection.components)
+
+    Projection.remove(str(tmp_path))
+
+    assert Projection.load(str(tmp_path)) is None
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        Projection.fit(_low_rank_features(), 5, 'ica')
+
+
+def test_random_without_sample():
+    projection = Projection.random(50, 40)
+
+    assert projection.method == 'random'
+    assert projection.input_dimension == 50
+    assert projection.dimension == 40
+    assert projection.key == Projection.fit(
+        _low_rank_features(), 40, 'random').key
+
+
+def test_pca_with_small_sample():
+    features = _low_rank_features(count=3)
+    projection = Projection.fit(features, 10, 'pca')
+
+    assert projection.dimension == 10
+    assert np.allclose(_distances(projection.transform(features)),
+                       _distances(features), atol=1e-3)
+
+
+def test_pca_within_memory_budget():
+    features = _low_rank_features()
+
+    # Room for 7 features at a time
+    chunked = Projection.fit(list(features), 5, 'pca', 7 * 50 * 4)
+    whole = Projection.fit(features, 5, 'pca')
+
+    assert np.allclose(chunked.mean, whole.mean, atol=1e-5)
+    assert np.allclose(_distances(chunked.transform(features)),
+                       _distances(whole.transform(features)), atol=1e-3)
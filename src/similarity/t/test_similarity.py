@@ -1,8 +1,10 @@
 import numpy as np
 import falconn
+from bson.objectid import ObjectId
 
+from similarity.index import SimilarityIndex
 from similarity.similarity import _load_songs, _dist, \
-    _create_bucket, _find_matches
+    _create_bucket, _find_matches, _rank_matches, _merge_neighbours
 from utilities.config_loader import load_config
 
 cfg = load_config()
@@ -58,3 +60,39 @@ def test_find_matches():
         map(lambda seg: (seg, query_object), segments))))
 
     assert len(matches[0]) == 10
+
+
+def test_rank_matches(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    index.append([(ObjectId(), str(i) + '-1-1', 0, np.array([i, 0]))
+                  for i in range(0, MATCHES + 5)])
+
+    segs = [(ObjectId(), '0-1-1', 0, np.array([0, 0]))]
+    candidates = [np.arange(0, MATCHES + 5)]
+
+    best = _rank_matches(index, segs, candidates)
+
+    assert len(best[0]) == MATCHES
+    # Row 0 is from the same song and must not be matched
+    assert best[0][0] == (1, 1.0)
+    assert list(map(lambda m: m[0], best[0])) == list(range(1, MATCHES + 1))
+
+
+def test_rank_matches_without_candidates(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    segs = [(ObjectId(), '0-1-1', 0, np.array([0, 0]))]
+
+    assert _rank_matches(index, segs, [np.empty(0, dtype=np.int64)]) == [[]]
+
+
+def test_merge_neighbours():
+    targets = np.array([b'a', b'b', b'a', b'a', b'a'], dtype='S12')
+    ids = np.array([b'x', b'x', b'y', b'x', b'z'], dtype='S12')
+    distances = np.array([3.0, 1.0, 2.0, 0.5, 4.0])
+
+    targets, ids, distances = _merge_neighbours(targets, ids, distances, 2)
+
+    # The closest duplicate is kept and lists are cut to the closest two
+    assert targets.tolist() == [b'a', b'a', b'b']
+    assert ids.tolist() == [b'x', b'y', b'x']
+    assert distances.tolist() == [0.5, 2.0, 1.0]
@@ -0,0 +1,43 @@
+import tasks
+
+
+class _Segments:
+    def get_segmented_song_ids(self, audio_ids):
+        return set(audio_ids)
+
+    def close(self):
+        pass
+
+
+class _AudioDB:
+    def get_completed(self, audio_ids):
+        return set(['1-1-1'])
+
+
+def _songs():
+    return [{'audio_id': '1-1-1'}, {'audio_id': '1-1-2'}]
+
+
+def test_remove_analyzed(monkeypatch):
+    monkeypatch.setattr(tasks, 'db', _AudioDB())
+    monkeypatch.setattr(tasks, 'SongSegment', _Segments)
+
+    songs = tasks._remove_analyzed({}, _songs())
+
+    assert songs == [{'audio_id': '1-1-2'}]
+
+
+def test_remove_analyzed_keeps_forced(monkeypatch):
+    monkeypatch.setattr(tasks, 'db', _AudioDB())
+    monkeypatch.setattr(tasks, 'SongSegment', _Segments)
+
+    assert tasks._remove_analyzed({'force': True}, _songs()) == _songs()
+
+
+def test_remove_analyzed_keeps_custom_bpm(monkeypatch):
+    monkeypatch.setattr(tasks, 'db', _AudioDB())
+    monkeypatch.setattr(tasks, 'SongSegment', _Segments)
+
+    data = {'config': {'BPM': {'minTempo': 100}}}
+
+    assert tasks._remove_analyzed(data, _songs()) == _songs()
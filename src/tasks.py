@@ -1,16 +1,21 @@
-from tempfile import NamedTemporaryFile
+import os
+import hashlib
 
-from celery import Celery
+import numpy as np
+from celery import Celery, chain
 
 from bpm.bpm_extractor import get_song_bpm
-from utilities.filehandler.audio_loader import get_mono_loaded_song
-from classification.classifier.profile_data_extractor import get_classifier_data
-from classification.extractor.low_level_data_extractor import make_low_level_data_file
-from similarity.similarity import _load_song, SongSegment
-from loudness.loudness_extractor import get_song_loudness
-from utilities.filehandler.audio_loader import get_audio_loaded_song
+from utilities.filehandler.audio_loader import decode_song, \
+    get_decoded_song, get_mono_resampled_song, get_stereo_loaded_song
+from classification.classifier.svm_classifier import get_song_classifier_data
+from similarity.similarity import _load_song, SongSegment, \
+    copy_song_features
+from loudness.loudness_extractor import get_decoded_song_loudness
 from utilities.config_loader import load_config
+from utilities.get_song_id import get_song_id
 from database.sql.audio import AudioDB
+from database.sql.audio_cache import get_audio_cache
+from database.mongo.audio.analysis_cache import AnalysisCache
 
 
 cfg = load_config()
@@ -21,11 +26,120 @@ app = Celery('tasks', backend='redis://@' +
 db = AudioDB()
 
 
+def _decoded_audio(x):
+    """Gets the decoded audio of the song and its sample rate, the file is
+    only decoded if no decoded copy is available on this worker
+    """
+
+    if 'DECODED' not in x or not os.path.isfile(x['DECODED']['path']):
+        path, sample_rate = decode_song(x['source_path'],
+                                        cfg['audio_cache_path'])
+        x['DECODED'] = dict({'path': path, 'sample_rate': sample_rate})
+
+    return get_decoded_song(x['DECODED']['path']), x['DECODED']['sample_rate']
+
+
+def _memory_audio(x):
+    """Creates a loader that decodes the song into memory the first time
+    it is called, for analyses that all run in the same task
+    """
+
+    decoded = {}
+
+    def load():
+        if 'audio' not in decoded:
+            decoded['audio'] = get_stereo_loaded_song(x['source_path'])
+
+        return decoded['audio']
+
+    return load
+
+
+def _content_hash(audio) -> str:
+    """Fingerprints decoded audio, so the same recording is recognised
+    regardless of its path, id or file tags
+    """
+
+    return hashlib.sha1(memoryview(np.ascontiguousarray(audio))).hexdigest()
+
+
+def _custom_bpm(x) -> bool:
+    return 'config' in x and 'BPM' in x['config']
+
+
+def _run_cache_lookup(x, audio) -> bool:
+    """Reuses the results of identical audio that has already been analyzed
+
+    Returns whether any results were taken from the cache
+    """
+
+    if x['FORCE'] or (x['BPM_DONE'] and x['MER_DONE'] and
+                      x['METERING_DONE'] and not _custom_bpm(x)):
+        return False
+
+    x['CONTENT_HASH'] = _content_hash(audio()[0])
+
+    cache = AnalysisCache()
+    entry = cache.get(x['CONTENT_HASH'])
+    cache.close()
+
+    if entry is None or entry['audio_id'] == x['audio_id']:
+        return False
+
+    print(x['audio_id'] + ' has the same audio as ' + entry['audio_id'])
+
+    found = False
+    if not x['BPM_DONE'] and not _custom_bpm(x) and 'BPM' in entry:
+        x['BPM'] = entry['BPM']
+        x['BPM_DONE'] = found = True
+
+    if not x['MER_DONE'] and 'timbre' in entry:
+        x['timbre'] = entry['timbre']
+        x['emotions'] = entry['emotions']
+        x['MER_DONE'] = found = True
+
+    if not x['METERING_DONE'] and 'loudness' in entry:
+        x['loudness'] = entry['loudness']
+        x['METERING_DONE'] = found = True
+
+    segments = SongSegment()
+    if segments.get_segmented_song_ids([x['audio_id']]) == set():
+        copy_song_features(entry['audio_id'], x['audio_id'], segments)
+    segments.close()
+
+    return found
+
+
+def _run_cache_store(x):
+    """Stores the results of the song by its audio fingerprint
+    """
+
+    if 'CONTENT_HASH' not in x:
+        return
+
+    entry = dict({'audio_id': x['audio_id']})
+
+    # BPM found with custom parameters is not a general result
+    if 'BPM' in x and not _custom_bpm(x):
+        entry['BPM'] = x['BPM']
+    if 'timbre' in x:
+        entry['timbre'] = x['timbre']
+        entry['emotions'] = x['emotions']
+    if 'loudness' in x:
+        entry['loudness'] = x['loudness']
+
+    cache = AnalysisCache()
+    cache.add(x['CONTENT_HASH'], entry)
+    cache.close()
+
+
 def _save_to_db(x):
-    if x['DB_EXISTS']:
-        db.update_all(x)
-    else:
-        db.post_all(x)
+    # Only the data the song has is written, so it does not matter whether
+    # the row is new
+    db.upsert([x])
+    get_audio_cache().invalidate(x['audio_id'])
+
+    x['DB_EXISTS'] = True
 
 
 @app.task
@@ -102,9 +216,24 @@ def check_done(x):
 
 
 @app.task
-def add_bpm(x):
-    if not x['BPM_DONE'] or ('config' in x and 'BPM' in x['config']):
-        song = get_mono_loaded_song(x['source_path'])
+def decode_audio(x):
+    if not x['BPM_DONE'] or not x['METERING_DONE'] or _custom_bpm(x):
+        _decoded_audio(x)
+
+    return x
+
+
+@app.task
+def lookup_cache(x):
+    if _run_cache_lookup(x, lambda: _decoded_audio(x)):
+        _save_to_db(x)
+
+    return x
+
+
+def _run_bpm(x, audio) -> bool:
+    if not x['BPM_DONE'] or _custom_bpm(x):
+        song = get_mono_resampled_song(*audio())
 
         params = {}
         if 'config' in x and 'BPM' in x['config']:
@@ -114,24 +243,17 @@ def add_bpm(x):
 
         x['BPM'] = dict({'value': bpm, 'confidence': confidence})
 
-        _save_to_db(x)
-        x['DB_EXISTS'] = True
-
         x['BPM_DONE'] = True
 
-    return x
+        return True
 
+    return False
 
-@app.task
-def add_emotions(x):
-    if not x['MER_DONE']:
-        temp_file = NamedTemporaryFile(delete=True)
 
-        make_low_level_data_file(x['source_path'], temp_file.name)
-        timbre, relaxed, party, aggressive, happy, sad = get_classifier_data(
-            temp_file.name)
-
-        temp_file.close()
+def _run_emotions(x) -> bool:
+    if not x['MER_DONE']:
+        timbre, relaxed, party, aggressive, happy, sad = \
+            get_song_classifier_data(x['source_path'])
 
         x['timbre'] = dict({
             'value': timbre[0],
@@ -160,36 +282,232 @@ def add_emotions(x):
             })
         })
 
-        _save_to_db(x)
-        x['DB_EXISTS'] = True
-
         x['MER_DONE'] = True
 
-    return x
+        return True
 
+    return False
 
-@app.task
-def add_metering(x):
+
+def _run_metering(x, audio) -> bool:
     if not x['METERING_DONE']:
-        audio_loaded_song = get_audio_loaded_song(x['source_path'])
-        max_loudness, integratedLoudness, loudnessRange = get_song_loudness(
-            audio_loaded_song)
+        max_loudness, integratedLoudness, loudnessRange = \
+            get_decoded_song_loudness(*audio())
         x['loudness'] = dict({
             'peak': max_loudness,
             'loudness_integrated': integratedLoudness,
             'loudness_range': loudnessRange,
         })
 
+        x['METERING_DONE'] = True
+
+        return True
+
+    return False
+
+
+def _run_similarity_features(x, audio):
+    _load_song(x['audio_id'], x['source_path'], SongSegment(), x['FORCE'],
+               audio)
+
+
+def _release_audio(x):
+    if 'DECODED' in x:
+        if os.path.isfile(x['DECODED']['path']):
+            os.remove(x['DECODED']['path'])
+
+        del x['DECODED']
+
+
+@app.task
+def add_bpm(x):
+    if _run_bpm(x, lambda: _decoded_audio(x)):
+        _save_to_db(x)
+
+    return x
+
+
+@app.task
+def add_emotions(x):
+    if _run_emotions(x):
         _save_to_db(x)
-        x['DB_EXISTS'] = True
 
-        x['METERING_DONE'] = True
+    return x
+
+
+@app.task
+def add_metering(x):
+    if _run_metering(x, lambda: _decoded_audio(x)):
+        _save_to_db(x)
 
     return x
 
 
 @app.task
 def add_similarity_features(x):
-    _load_song(x['audio_id'], x['source_path'], SongSegment(), x['FORCE'])
+    _run_similarity_features(x, lambda: _decoded_audio(x))
+
+    return x
+
+
+@app.task
+def store_cache(x):
+    _run_cache_store(x)
+
+    return x
+
+
+@app.task
+def release_audio(x):
+    _release_audio(x)
+
+    return x
+
+
+@app.task
+def analyze_track(x):
+    """Runs every analysis of a track in a single task, sharing the decoded
+    audio in memory and saving the results with a single database write
+    """
+
+    x = check_done(x)
+
+    audio = _memory_audio(x)
+
+    changed = [
+        _run_cache_lookup(x, audio),
+        _run_bpm(x, audio),
+        _run_emotions(x),
+        _run_metering(x, audio),
+    ]
+
+    if any(changed):
+        _save_to_db(x)
+
+    _run_similarity_features(x, audio)
+
+    _run_cache_store(x)
 
     return x
+
+
+pipeline = chain(
+    check_done.s().set(priority=1),
+    decode_audio.s().set(priority=1),
+    lookup_cache.s().set(priority=1),
+    add_bpm.s().set(priority=2),
+    add_emotions.s().set(priority=3),
+    add_metering.s().set(priority=4),
+    add_similarity_features.s().set(priority=5),
+    store_cache.s().set(priority=5),
+    release_audio.s().set(priority=5),
+)
+
+# Runs every analysis of a track in one task on one worker
+fused_pipeline = analyze_track.s().set(priority=1)
+
+
+def is_song(song_path):
+    return song_path.endswith(("mp3", "wav"))
+
+
+def make_song(data, song_path):
+    """Creates the pipeline input for a song from an analysis request
+    """
+
+    force = data['force'] if 'force' in data else False
+    config = data['config'] if 'config' in data else {}
+
+    return dict({
+        'audio_id': get_song_id(song_path),
+        'source_path': song_path,
+        'FORCE': force,
+        'config': config,
+    })
+
+
+def song_pipeline(data):
+    """Gets the pipeline an analysis request should run in
+    """
+
+    fused = (data['fused'] if 'fused' in data
+             else cfg['pipeline_mode'] == 'fused')
+
+    return fused_pipeline if fused else pipeline
+
+
+def _scan_songs(path):
+    """Recursively yields the path of every song in the given directory
+    """
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_songs(entry.path)
+            elif entry.is_file() and is_song(entry.name):
+                yield entry.path
+
+
+def _remove_analyzed(data, songs):
+    """Removes the songs that have already been fully analyzed, checking
+    all of them at once, unless an analysis is forced to run again
+    """
+
+    # A custom BPM config reruns the BPM analysis of analyzed songs as well
+    if ('force' in data and data['force']) or _custom_bpm(data):
+        return songs
+
+    audio_ids = list(map(lambda song: song['audio_id'], songs))
+
+    segments = SongSegment()
+    analyzed = (db.get_completed(audio_ids) &
+                segments.get_segmented_song_ids(audio_ids))
+    segments.close()
+
+    return list(filter(lambda song: song['audio_id'] not in analyzed, songs))
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if len(batch) > 0:
+        yield batch
+
+
+@app.task(bind=True)
+def ingest_directory(self, data):
+    """Finds every song in a directory tree and adds it to the pipeline,
+    publishing the songs in batches over a single broker connection
+
+    Songs that have already been analyzed are looked up a batch at a
+    time and skipped, unless the request forces every analysis to run
+
+    The progress is reported through the task state, so it can be queried
+    with the id of the task
+    """
+
+    progress = dict({'found': 0, 'enqueued': 0, 'skipped': 0})
+    songs_pipeline = song_pipeline(data)
+
+    with app.producer_or_acquire() as producer:
+        for batch in _batches(_scan_songs(data['source_path']),
+                              cfg['ingest_batch_size']):
+            songs = _remove_analyzed(
+                data, list(map(lambda path: make_song(data, path), batch)))
+
+            for song in songs:
+                songs_pipeline.apply_async((song,), producer=producer)
+
+            progress['found'] += len(batch)
+            progress['enqueued'] += len(songs)
+            progress['skipped'] += len(batch) - len(songs)
+
+            self.update_state(state='PROGRESS', meta=progress)
+
+    return progress
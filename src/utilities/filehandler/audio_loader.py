@@ -1,4 +1,11 @@
-from essentia.standard import MonoLoader
+import os
+import time
+import uuid
+from typing import Tuple
+
+import numpy as np
+from essentia.standard import MonoLoader, Resample
+from essentia.standard import AudioLoader as StandardAudioLoader
 from essentia.streaming import AudioLoader
 
 from utilities.filehandler.handle_path import get_absolute_path
@@ -44,3 +51,109 @@ def get_audio_loaded_song(song_path: str):
     loader = AudioLoader(filename=path)
 
     return loader
+
+
+def get_stereo_loaded_song(song_path: str) -> Tuple[object, int]:
+    """Decodes the file given at the path into memory
+
+    Parameters
+    ----------
+    song_path : str
+        The file path of the song
+
+    Returns
+    -------
+    Tuple[stereosample, int]
+        The decoded stereo audio signal and its sample rate
+    """
+
+    path = get_absolute_path(song_path)
+    audio, sample_rate = StandardAudioLoader(filename=path)()[:2]
+
+    return audio, int(sample_rate)
+
+
+def decode_song(song_path: str, cache_dir: str,
+                max_age: int = 24*60*60) -> Tuple[str, int]:
+    """Decodes the file given at the path once and stores the raw stereo
+    audio in the cache directory, so it can be memory-mapped by every
+    analysis instead of being decoded again
+
+    Parameters
+    ----------
+    song_path : str
+        The file path of the song
+    cache_dir : str
+        The directory to store the decoded audio in
+    max_age : int, optional
+        Decoded files older than this many seconds are removed, as they were
+        left behind by analyses that never finished
+
+    Returns
+    -------
+    Tuple[str, int]
+        The path of the decoded audio and its sample rate
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    for name in os.listdir(cache_dir):
+        stale_path = os.path.join(cache_dir, name)
+        try:
+            if time.time() - os.path.getmtime(stale_path) > max_age:
+                os.remove(stale_path)
+        except OSError:
+            pass
+
+    audio, sample_rate = get_stereo_loaded_song(song_path)
+
+    decoded_path = os.path.join(cache_dir, uuid.uuid4().hex + ".npy")
+    np.save(decoded_path, audio)
+
+    return decoded_path, sample_rate
+
+
+def get_decoded_song(decoded_path: str):
+    """Memory-maps audio decoded by decode_song
+
+    Parameters
+    ----------
+    decoded_path : str
+        The path of the decoded audio
+
+    Returns
+    -------
+    stereosample
+        The decoded stereo audio signal
+    """
+
+    return np.load(decoded_path, mmap_mode='r')
+
+
+def get_mono_resampled_song(audio, sample_rate: int,
+                            target_rate: int = 44100):
+    """Downmixes decoded stereo audio to mono and resamples it the same
+    way the MonoLoader does
+
+    Parameters
+    ----------
+    audio
+        The decoded stereo audio signal
+    sample_rate : int
+        The sample rate of the decoded audio
+    target_rate : int, optional
+        The sample rate to resample to
+
+    Returns
+    -------
+    vector_real
+        The audio downmixed to mono at the target sample rate
+    """
+
+    mono = np.mean(audio, axis=1, dtype=np.float32)
+
+    if sample_rate == target_rate:
+        return mono
+
+    return Resample(inputSampleRate=sample_rate,
+                    outputSampleRate=target_rate)(mono)
@@ -1,12 +1,23 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
 from typing import Dict
 
 import cv2
 import numpy
 from keras.models import load_model
-from keras import backend as K
 
+from utilities.config_loader import load_config
 from utilities.filehandler.handle_path import get_absolute_path
 
+cfg = load_config()
+BATCH_SIZE = cfg.get('video_emotion_batch_size', 32)
+
+EMOTION_MODEL_PATH = get_absolute_path("video_emotion/" +
+                                       "emotion_tagger/" +
+                                       "models/emotion_model.hdf5")
+
 
 def get_labels() -> Dict[int, str]:
     """Get the labels for each argument in the emotion array
@@ -41,6 +52,133 @@ def preprocess_input(x: float) -> float:
     return ((x / 255.0) - 0.5) * 2.0
 
 
+def _process_face(face, target_size):
+    face_grey = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    face_resized = cv2.resize(face_grey, (target_size))
+    face_processed = preprocess_input(face_resized)
+    return numpy.expand_dims(face_processed, -1)
+
+
+class EmotionClassifier:
+    """
+    A long-lived service that keeps the emotion model loaded and classifies
+    the faces of all concurrent requests together in micro-batches
+
+    Methods
+    -------
+    classify(faces)
+        Classifies the given faces, waiting for the result
+    """
+
+    def __init__(self, model_path: str, batch_size: int):
+        self._model_path = model_path
+        self._batch_size = batch_size
+        self._requests = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def classify(self, faces) -> [[float]]:
+        """Classifies the given faces, waiting for the result
+
+        Parameters
+        ----------
+        faces
+            The faces to be processed
+
+        Returns
+        -------
+        array
+            The emotion data of each face, indexed like in getlabels
+        """
+
+        future = Future()
+        self._requests.put((faces, future))
+
+        return future.result()
+
+    def _next_requests(self):
+        # Waits for a request, then takes every waiting request
+        # that fits in the same batch
+        requests = [self._requests.get()]
+        count = len(requests[0][0])
+
+        while count < self._batch_size:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+
+            requests.append(request)
+            count += len(request[0])
+
+        return requests
+
+    def _run(self):
+        # The model is loaded and only ever used by this thread,
+        # so the graph and session it creates belong to it
+        try:
+            model = load_model(self._model_path)
+            target_size = model.input_shape[1:3]
+            output_size = model.output_shape[-1]
+        except Exception as e:
+            while True:
+                self._requests.get()[1].set_exception(e)
+
+        while True:
+            requests = self._next_requests()
+
+            try:
+                processed_faces = []
+                for faces, _ in requests:
+                    for face in faces:
+                        processed_faces.append(
+                            _process_face(face, target_size))
+
+                if len(processed_faces) > 0:
+                    predictions = model.predict(
+                        numpy.asarray(processed_faces),
+                        batch_size=self._batch_size)
+                else:
+                    predictions = numpy.empty((0, output_size))
+
+                start = 0
+                for faces, future in requests:
+                    future.set_result(predictions[start:start + len(faces)])
+                    start += len(faces)
+            except Exception as e:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+_classifier = None
+_classifier_pid = None
+_classifier_lock = threading.Lock()
+
+
+def get_emotion_classifier() -> EmotionClassifier:
+    """Gets the emotion classifier of this process, starting it
+    the first time it is needed
+
+    Returns
+    -------
+    EmotionClassifier
+        The emotion classifier service
+    """
+
+    global _classifier, _classifier_pid
+
+    with _classifier_lock:
+        # A forked process does not inherit the service thread,
+        # so it needs to start its own
+        if _classifier is None or _classifier_pid != os.getpid():
+            _classifier = EmotionClassifier(EMOTION_MODEL_PATH, BATCH_SIZE)
+            _classifier_pid = os.getpid()
+
+        return _classifier
+
+
 def classify_faces(faces) -> [[float]]:
     """Classifies the given faces
 
@@ -57,26 +195,4 @@ def classify_faces(faces) -> [[float]]:
         indexed like in getlabels
     """
 
-    # parameters for loading data and images
-    emotion_model_path = get_absolute_path("video_emotion/" +
-                                           "emotion_tagger/" +
-                                           "models/emotion_model.hdf5")
-
-    # loading models
-    emotion_classifier = load_model(emotion_model_path)
-
-    # getting input model shapes for inference
-    emotion_target_size = emotion_classifier.input_shape[1:3]
-    processed_faces = []
-    for face in faces:
-        face_grey = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
-        face_resized = cv2.resize(face_grey, (emotion_target_size))
-        face_processed = preprocess_input(face_resized)
-        face_expanded_more = numpy.expand_dims(face_processed, -1)
-        processed_faces.append(face_expanded_more)
-
-    emotion_prediction = emotion_classifier.predict(numpy.
-                                                    asarray(processed_faces))
-    K.clear_session()
-
-    return emotion_prediction
+    return get_emotion_classifier().classify(faces)
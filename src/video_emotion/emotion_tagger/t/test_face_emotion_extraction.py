@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import cv2
 
@@ -7,6 +9,8 @@ from video_emotion.emotion_tagger.\
     face_emotion_extraction import get_labels
 from video_emotion.emotion_tagger.\
     face_emotion_extraction import preprocess_input
+from video_emotion.emotion_tagger.\
+    face_emotion_extraction import get_emotion_classifier
 from utilities.filehandler.handle_path import get_absolute_path
 
 current_directory = "video_emotion/emotion_tagger/t/"
@@ -105,3 +109,26 @@ def test_Many_Faces():
     assert list_with_faces[0][3] > 0.5
     assert list_with_faces[1][3] > 0.5
     assert list_with_faces[2][3] > 0.3
+
+
+def test_no_faces():
+    assert len(classify_faces([])) == 0
+
+
+def test_classifier_is_reused():
+    assert get_emotion_classifier() is get_emotion_classifier()
+
+
+def test_concurrent_requests():
+    filename = get_absolute_path(current_directory +
+                                 "test_face_emotion_extra" +
+                                 "ction_data/happy1.png")
+    img = cv2.imread(filename)
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(
+            lambda count: classify_faces([img] * count), range(1, 9)))
+
+    for count, result in enumerate(results, 1):
+        assert len(result) == count
+        assert result[-1][3] > 0.5
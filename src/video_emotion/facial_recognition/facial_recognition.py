@@ -1,21 +1,48 @@
 import os
-from typing import Dict
+import math
+import threading
+from typing import Dict, List
+from multiprocessing import current_process
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import cv2
 
+from utilities.config_loader import load_config
 from utilities.filehandler.handle_path import get_absolute_path
 
+cfg = load_config()
+
 dirname = os.path.dirname(__file__)
 CONFIDENCE_MINIMUM = 0.7
 
+# The number of frames analyzed per second of video, 0 analyzes every frame
+SAMPLE_FPS = cfg['video_sample_fps']
+
+# The number of sampled frames passed through the detector at once
+DETECTION_BATCH_SIZE = cfg['video_detection_batch_size']
+
+# Time ranges longer than a chunk, in milliseconds, are split up and the
+# chunks analyzed in parallel by this number of workers
+CHUNK_LENGTH = cfg['video_chunk_length']
+CHUNK_WORKERS = cfg['video_chunk_workers']
+
 OPENCV_PROTOTXT = get_absolute_path("video_emotion/facial_recognition/" +
                                     "deploy.prototxt.txt")
 
 OPENCV_MODEl = get_absolute_path("video_emotion/facial_recognition/res10" +
                                  "_300x300_ssd_iter_140000_fp16.caffemodel")
-# Load model from disk
-NET = cv2.dnn.readNetFromCaffe(OPENCV_PROTOTXT, OPENCV_MODEl)
+
+
+def _load_net():
+    # Load model from disk
+    return cv2.dnn.readNetFromCaffe(OPENCV_PROTOTXT, OPENCV_MODEl)
+
+
+NET = _load_net()
+
+# The network of each chunk worker thread or process
+_worker = threading.local()
 
 # Various numeral constants
 IMAGE_RESIZE = 300
@@ -25,7 +52,8 @@ GREEN = 177.0
 BLUE = 123.0
 
 
-def analyze_video(video_path: str, time_range: int =None) -> Dict:
+def analyze_video(video_path: str, time_range: int = None,
+                  sample_fps: float = SAMPLE_FPS) -> Dict:
     """Analyses video finding faces, given videopath and a timerange
 
     Parameters
@@ -35,6 +63,9 @@ def analyze_video(video_path: str, time_range: int =None) -> Dict:
     time_range : int, optional
         the time range in the video you want analyzed
         Given none the entire video will be analyzed
+    sample_fps : float, optional
+        the number of frames to analyze per second of video,
+        given 0 every frame will be analyzed
 
     Returns
     -------
@@ -42,40 +73,136 @@ def analyze_video(video_path: str, time_range: int =None) -> Dict:
         A dictionary of the facetuples found from the frames
     """
 
-    if time_range is not None:
-        fro, to = time_range
+    fro, to = time_range or (0, _video_length(video_path))
+
+    if to == float('inf') or to - fro <= CHUNK_LENGTH or CHUNK_WORKERS <= 1:
+        return _analyze_range(video_path, fro, to, sample_fps, NET)
+
+    chunks = [(start, min(start + CHUNK_LENGTH, to))
+              for start in range(int(fro), int(to), CHUNK_LENGTH)]
+
+    # Inside a worker process, like a job of the video API's scheduler,
+    # chunks run on threads so that the number of processes stays bound by
+    # the scheduler. OpenCV releases the GIL while decoding and running the
+    # network, so threads still make use of the other cores
+    if current_process().name != 'MainProcess':
+        executor = ThreadPoolExecutor(max_workers=CHUNK_WORKERS)
+    else:
+        executor = ProcessPoolExecutor(max_workers=CHUNK_WORKERS)
+
+    with executor:
+        results = executor.map(_analyze_chunk,
+                               [video_path] * len(chunks),
+                               [start for start, _ in chunks],
+                               [end for _, end in chunks],
+                               [sample_fps] * len(chunks),
+                               [fro] * len(chunks))
+
+        # Frames on the edge of two chunks are found by both, but they
+        # share the same timestamp and are only kept once
+        dict_of_faces = {}
+        for chunk_faces in results:
+            dict_of_faces.update(chunk_faces)
+
+    return dict_of_faces
+
+
+def _video_length(video_path: str) -> float:
+    # The length of the video in milliseconds, or infinity if the
+    # container does not tell
+    cap = cv2.VideoCapture(video_path)
+    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    if frame_count <= 0 or fps <= 0:
+        return float('inf')
+
+    return frame_count / fps * 1000
+
+
+def _analyze_chunk(video_path: str, fro: float, to: float,
+                   sample_fps: float, origin: float) -> Dict:
+    # A network can only run one input at a time, so every worker loads its
+    # own network once, with its first chunk
+    if not hasattr(_worker, 'net'):
+        _worker.net = _load_net()
+
+    return _analyze_range(video_path, fro, to, sample_fps, _worker.net,
+                          origin)
+
+
+def _analyze_range(video_path: str, fro: float, to: float,
+                   sample_fps: float, net, origin: float = None) -> Dict:
+    interval = 1000 / sample_fps if sample_fps else 0
+
+    # Frames are sampled at origin + k * interval, so the chunks of a time
+    # range sample the same frames the whole range would
+    if origin is None:
+        origin = fro
+
     cap = cv2.VideoCapture(video_path)
     cap.set(cv2.CAP_PROP_POS_MSEC, fro)  # Jump to specified time in video
     dict_of_faces = {}
+    timestamps, frames = [], []
+    next_sample = _next_sample(origin, fro, interval, math.ceil)
     while cap.isOpened():
-        # Get frame from video
-        ret, frame = cap.read()
+        # Get the next frame, without converting it to an image yet
+        if not cap.grab():
+            break
 
-        # Check if we received a frame
+        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)
+
+        # Skip frames that are not within the given time_range, as seeking
+        # may land before it, and frames in between samples
+        if timestamp > to:
+            break
+        elif timestamp < fro or timestamp < next_sample:
+            continue
+
+        next_sample = _next_sample(origin, timestamp, interval,
+                                   lambda k: math.floor(k) + 1)
+
+        # Only the sampled frames are converted to images
+        ret, frame = cap.retrieve()
         if ret is False:
             break
 
-        # Ignore frames that are not within the given time_range
-        if time_range is not None:
-            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)
-            if timestamp < fro:
-                continue
-            elif timestamp > to:
-                break
+        # Frames are collected and passed to the detector in batches
+        timestamps.append(timestamp)
+        frames.append(frame)
+        if len(frames) >= DETECTION_BATCH_SIZE:
+            _add_faces(dict_of_faces, timestamps, frames, net)
+            timestamps, frames = [], []
 
-        # Get faces from frame
-        faces = analyze_frame(frame)
+    _add_faces(dict_of_faces, timestamps, frames, net)
 
-        # Add found frames to our dictionary
-        if len(faces) > 0:
-            # save current time rounded
-            dict_of_faces[str(int(cap.get(cv2.CAP_PROP_POS_MSEC)))] = faces
     # Release resources used to open video
     cap.release()
 
     return dict_of_faces
 
 
+def _next_sample(origin: float, timestamp: float, interval: float,
+                 step) -> float:
+    # The point of the sample grid picked by rounding the number of
+    # intervals since the origin with step
+    if interval == 0:
+        return timestamp
+
+    return origin + step((timestamp - origin) / interval) * interval
+
+
+def _add_faces(dict_of_faces: Dict, timestamps: List[float],
+               frames: list, net):
+    # Get faces from the frames
+    for timestamp, faces in zip(timestamps, analyze_frames(frames, net)):
+        # Add found frames to our dictionary
+        if len(faces) > 0:
+            # save current time rounded
+            dict_of_faces[str(int(timestamp))] = faces
+
+
 def analyze_frame(frame) -> [[int, int]]:
     """Analyses a single frame, finding faces returning as a coordinate
 
@@ -90,57 +217,72 @@ def analyze_frame(frame) -> [[int, int]]:
         A list of facetuples that describe the placement of a face in the frame
     """
 
-    # Get width and height of frame
-    (h, w) = frame.shape[:2]
+    return analyze_frames([frame])[0]
 
-    # Resize frame and load it as blob
-    blob = cv2.dnn.blobFromImage(cv2.resize(frame,
-                                            (IMAGE_RESIZE, IMAGE_RESIZE)),
-                                 SIZE_CONSTANT,
-                                 (IMAGE_RESIZE, IMAGE_RESIZE),
-                                 (RED, GREEN, BLUE))
 
-    # Detect faces in the frame and loop over the detections
-    NET.setInput(blob)
-    detections = NET.forward()
+def analyze_frames(frames: list, net=NET) -> List[list]:
+    """Analyses a batch of frames with a single pass through the network
 
-    faces_tuple = []
-    for i in range(0, detections.shape[2]):
-        # extract the confidence of this specific detection
-        confidence = detections[0, 0, i, 2]
+    Parameters
+    ----------
+    frames : list
+        the frames of the video taken from cap.read()
+    net : optional
+        the face detection network to use, the one loaded with the
+        module is used if none is given
 
-        # Ignore detections with confidences lower
-        # than the set minimum confidence
-        if confidence < CONFIDENCE_MINIMUM:
-            continue
+    Returns
+    -------
+    List[list]
+        A list of facetuples for each of the frames, in the same order
+    """
 
-        # Get the bounding bounding_box of the detection
-        bounding_box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-        (startX, startY, endX, endY) = bounding_box.astype("int")
+    if len(frames) == 0:
+        return []
 
-        # Filter out detections that are outside the image boundary
-        # (Not sure why the NN does this)
-        if startX >= w or startY >= h or endX <= 0 or endY <= 0:
-            continue
+    # Resize frames and load them as a single blob
+    blob = cv2.dnn.blobFromImages([cv2.resize(frame,
+                                              (IMAGE_RESIZE, IMAGE_RESIZE))
+                                   for frame in frames],
+                                  SIZE_CONSTANT,
+                                  (IMAGE_RESIZE, IMAGE_RESIZE),
+                                  (RED, GREEN, BLUE))
 
-        # Fix partly out of bounds detections
-        if endX > w:
-            endX = w
-        if endY > h:
-            endY = h
-        if startX < 0:
-            startX = 0
-        if startY < 0:
-            startY = 0
-
-        # Remove detections that have an x to y ratio and
-        # therefore likely, do not contain a face
-        xy_ratio = 1 / (endX - startX) * (endY - startY)
-        if xy_ratio < 0.5 or xy_ratio > 2:
-            continue
+    # Detect faces in all the frames, each detection is a row of
+    # [image id, label, confidence, startX, startY, endX, endY]
+    net.setInput(blob)
+    detections = net.forward().reshape(-1, 7)
+
+    # Ignore detections with confidences lower
+    # than the set minimum confidence
+    detections = detections[detections[:, 2] >= CONFIDENCE_MINIMUM]
+    image_ids = detections[:, 0].astype(int)
+
+    # Get the bounding boxes of the detections, scaled by the width and
+    # height of the frame each detection belongs to
+    sizes = np.array([[frame.shape[1], frame.shape[0]] for frame in frames])
+    (w, h) = sizes[image_ids].T
+    boxes = (detections[:, 3:7] *
+             np.stack([w, h, w, h], axis=1)).astype(int)
+    (startX, startY, endX, endY) = boxes.T
+
+    # Filter out detections that are outside the image boundary
+    # (Not sure why the NN does this)
+    inside = (startX < w) & (startY < h) & (endX > 0) & (endY > 0)
+
+    # Fix partly out of bounds detections
+    startX, startY = np.maximum(startX, 0), np.maximum(startY, 0)
+    endX, endY = np.minimum(endX, w), np.minimum(endY, h)
+
+    # Remove detections that have an x to y ratio and
+    # therefore likely, do not contain a face
+    width, height = endX - startX, endY - startY
+    ratio = (width > 0) & (height >= 0.5 * width) & (height <= 2 * width)
 
-        # Cut face out of frame and add it to our array of faces
-        face = frame[int(startY):int(endY), int(startX):int(endX)]
-        faces_tuple.append(face)
+    faces_tuples = [[] for _ in frames]
+    for i in np.flatnonzero(inside & ratio):
+        # Cut face out of frame and add it to the faces of that frame
+        face = frames[image_ids[i]][startY[i]:endY[i], startX[i]:endX[i]]
+        faces_tuples[image_ids[i]].append(face)
 
-    return faces_tuple
+    return faces_tuples
@@ -1,4 +1,8 @@
-from video_emotion.facial_recognition.facial_recognition import analyze_video
+import cv2
+
+import video_emotion.facial_recognition.facial_recognition as recognition
+from video_emotion.facial_recognition.facial_recognition import (
+    analyze_video, analyze_frame, analyze_frames)
 from utilities.filehandler.handle_path import get_absolute_path
 
 
@@ -11,3 +15,68 @@ def test_facial_recognition_of_at_least_one_face():
     output_frames = analyze_video(test_filename, (3000, 5000))
 
     assert len(output_frames) != 0
+
+
+def test_sampling_analyzes_fewer_frames():
+    test_filename = (get_absolute_path
+                     ("video_emotion/facial_recognition/t/test" +
+                      "_facial_recognition/Fun_at_a_Fair.mp4"))
+
+    all_frames = analyze_video(test_filename, (3000, 5000), 0)
+    sampled_frames = analyze_video(test_filename, (3000, 5000), 2)
+
+    assert len(sampled_frames) != 0
+    assert len(sampled_frames) <= 5
+    assert len(sampled_frames) < len(all_frames)
+
+
+def test_chunks_sample_the_same_frames(monkeypatch):
+    test_filename = (get_absolute_path
+                     ("video_emotion/facial_recognition/t/test" +
+                      "_facial_recognition/Fun_at_a_Fair.mp4"))
+
+    whole = analyze_video(test_filename, (3000, 5000), 3)
+
+    monkeypatch.setattr(recognition, 'CHUNK_LENGTH', 700)
+    monkeypatch.setattr(recognition, 'CHUNK_WORKERS', 2)
+    chunked = analyze_video(test_filename, (3000, 5000), 3)
+
+    assert sorted(chunked.keys()) == sorted(whole.keys())
+
+
+def test_batched_detection_matches_single_frames():
+    test_filename = (get_absolute_path
+                     ("video_emotion/facial_recognition/t/test" +
+                      "_facial_recognition/Fun_at_a_Fair.mp4"))
+
+    cap = cv2.VideoCapture(test_filename)
+    cap.set(cv2.CAP_PROP_POS_MSEC, 3000)
+    frames = [cap.read()[1] for _ in range(4)]
+    cap.release()
+
+    batched = analyze_frames(frames)
+
+    assert len(batched) == len(frames)
+    for frame, faces in zip(frames, batched):
+        single = analyze_frame(frame)
+        assert len(faces) == len(single)
+        for face, single_face in zip(faces, single):
+            assert face.shape == single_face.shape
+
+
+def test_no_frames():
+    assert analyze_frames([]) == []
+
+
+def test_chunked_analysis(monkeypatch):
+    test_filename = (get_absolute_path
+                     ("video_emotion/facial_recognition/t/test" +
+                      "_facial_recognition/Fun_at_a_Fair.mp4"))
+
+    monkeypatch.setattr(recognition, 'CHUNK_LENGTH', 500)
+    monkeypatch.setattr(recognition, 'CHUNK_WORKERS', 2)
+
+    output_frames = analyze_video(test_filename, (3000, 5000))
+
+    assert len(output_frames) != 0
+    assert all(3000 <= int(time) <= 5000 for time in output_frames)
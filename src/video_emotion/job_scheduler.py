@@ -0,0 +1,153 @@
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class JobScheduler:
+    """
+    Runs jobs on a bounded pool of worker processes, refusing new jobs
+    once a set number of them are waiting or running. Jobs are given an id
+    that can be used to look up their state until they are forgotten.
+
+    A worker process that dies breaks the whole pool, the jobs that were
+    waiting or running then fail and the pool is started again.
+
+    Every worker runs one job at a time, with its own models, so work is
+    only batched within a job and never across jobs. This keeps a job that
+    crashes a worker from taking down the others, at the cost of loading
+    the models once per worker.
+
+    Methods
+    -------
+    submit(function, *args)
+        Starts a job, unless too many jobs are already pending
+
+    pending()
+        Gets the number of jobs that are waiting or running
+
+    status(job_id)
+        Gets the state of a job
+
+    shutdown()
+        Stops the worker processes once the pending jobs are done
+    """
+
+    def __init__(self, max_workers: int, max_pending: int,
+                 max_finished: int = 1000):
+        self._max_workers = max_workers
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        self._max_pending = max(max_pending, max_workers)
+        self._max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args) -> str:
+        """Starts a job, unless too many jobs are already pending
+
+        Parameters
+        ----------
+        function
+            The function to run, it has to be picklable
+        args
+            The arguments to call the function with
+
+        Returns
+        -------
+        str
+            The id of the job, or None if the scheduler is full
+        """
+
+        with self._lock:
+            if self._pending() >= self._max_pending:
+                return None
+
+            job_id = uuid4().hex
+
+            try:
+                job = self._executor.submit(function, *args)
+            except BrokenProcessPool:
+                self._restart()
+                job = self._executor.submit(function, *args)
+
+            self._jobs[job_id] = job
+            self._forget_finished()
+
+        return job_id
+
+    def pending(self) -> int:
+        """Gets the number of jobs that are waiting or running
+
+        Returns
+        -------
+        int
+            The number of jobs that are not done
+        """
+
+        with self._lock:
+            return self._pending()
+
+    def status(self, job_id: str) -> dict:
+        """Gets the state of a job
+
+        Parameters
+        ----------
+        job_id : str
+            The id returned when the job was submitted
+
+        Returns
+        -------
+        dict
+            The id and state of the job and the error if it failed,
+            or None if the job is not known
+        """
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+
+        if job is None:
+            return None
+
+        result = {'job_id': job_id}
+
+        if not job.done():
+            result['state'] = 'STARTED' if job.running() else 'PENDING'
+        elif job.cancelled():
+            result['state'] = 'REVOKED'
+        elif job.exception() is not None:
+            result['state'] = 'FAILURE'
+            result['error'] = str(job.exception())
+        else:
+            result['state'] = 'SUCCESS'
+
+        return result
+
+    def shutdown(self):
+        """Stops the worker processes once the pending jobs are done"""
+
+        self._executor.shutdown(wait=True)
+
+    def _restart(self):
+        # The jobs of the broken pool will never finish, so they are failed
+        # rather than left pending, which would fill up the scheduler
+        for job_id, job in self._jobs.items():
+            if not job.done():
+                failed = Future()
+                failed.set_exception(BrokenProcessPool(
+                    "A worker process died while the job was running"))
+                self._jobs[job_id] = failed
+
+        self._executor.shutdown(wait=False)
+        self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+
+    def _pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.done())
+
+    def _forget_finished(self):
+        # Drops the oldest finished jobs so the job list does not grow
+        # for as long as the API runs
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.done()]
+        for job_id in finished[:max(0, len(finished) - self._max_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,84 @@
+import os
+import time
+
+from video_emotion.job_scheduler import JobScheduler
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return True
+
+
+def _fail():
+    raise ValueError("failed")
+
+
+def _crash():
+    os._exit(1)
+
+
+def _wait_until_done(scheduler, job_id):
+    for _ in range(100):
+        status = scheduler.status(job_id)
+        if status['state'] in ('SUCCESS', 'FAILURE'):
+            return status
+        time.sleep(0.1)
+
+    return status
+
+
+def test_job_succeeds():
+    scheduler = JobScheduler(1, 1)
+
+    job_id = scheduler.submit(_sleep, 0)
+
+    assert job_id is not None
+    assert _wait_until_done(scheduler, job_id)['state'] == 'SUCCESS'
+
+    scheduler.shutdown()
+
+
+def test_job_failure_is_reported():
+    scheduler = JobScheduler(1, 1)
+
+    status = _wait_until_done(scheduler, scheduler.submit(_fail))
+
+    assert status['state'] == 'FAILURE'
+    assert status['error'] == 'failed'
+
+    scheduler.shutdown()
+
+
+def test_full_scheduler_refuses_jobs():
+    scheduler = JobScheduler(1, 2)
+
+    assert scheduler.submit(_sleep, 1) is not None
+    assert scheduler.submit(_sleep, 1) is not None
+    assert scheduler.submit(_sleep, 1) is None
+    assert scheduler.pending() == 2
+
+    scheduler.shutdown()
+
+    assert scheduler.pending() == 0
+
+
+def test_unknown_job():
+    scheduler = JobScheduler(1, 1)
+
+    assert scheduler.status('unknown') is None
+
+    scheduler.shutdown()
+
+
+def test_recovers_from_dead_worker():
+    scheduler = JobScheduler(1, 2)
+
+    status = _wait_until_done(scheduler, scheduler.submit(_crash))
+    assert status['state'] == 'FAILURE'
+
+    job_id = scheduler.submit(_sleep, 0)
+
+    assert job_id is not None
+    assert _wait_until_done(scheduler, job_id)['state'] == 'SUCCESS'
+
+    scheduler.shutdown()